@@ -1,7 +1,12 @@
 import logging
 import os
+import numpy as np
 import pandas as pd
 
+from cube_utils import Cube
+from report_utils import ReportWriter
+from results_utils import ResultsStore
+
 class ANOVA():
     """
     Class that performs ANOVA analysis.
@@ -18,222 +23,376 @@ class ANOVA():
         """
         self.city = city
 
-    def normal_anova(city:str, data:pd.DataFrame, agg:str='hourly'):
+    def oneway_from_stats(count:np.ndarray, total:np.ndarray, sumsq:np.ndarray, axis:int=0) -> tuple:
         """
-        Public class method that performs ANOVA analysis on the data to check if the means of the data are different for different years
-        and saves the results to results folder.
+        Public class method that performs one-way ANOVA from the count, sum and sum of squares of every group,
+        for all the tests along the other axes at once. Gives the same F and p values as scipy's f_oneway on the raw groups.
+
+        Parameters
+        ----------
+        count : np.ndarray
+            The number of values in every group.
+        total : np.ndarray
+            The sum of the values in every group.
+        sumsq : np.ndarray
+            The sum of the squared values in every group.
+        axis : int
+            The axis along which the groups are. Default is 0.
+
+        Returns
+        -------
+        np.ndarray
+            The F-values of the tests.
+        np.ndarray
+            The p-values of the tests.
+        """
+        from scipy.stats import f as f_dist
+
+        # the differences of sums below lose too much precision in float32, the sums are taken as float64
+        count, total, sumsq = (np.asarray(array, dtype=np.float64) for array in (count, total, sumsq))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            n = count.sum(axis=axis)
+            groups = (count > 0).sum(axis=axis)
+            between = np.where(count > 0, total * total / count, 0.0).sum(axis=axis)
+
+            ss_between = between - total.sum(axis=axis) ** 2 / n
+            ss_within = sumsq.sum(axis=axis) - between
+
+            f = (ss_between / (groups - 1)) / (ss_within / (n - groups))
+            p = f_dist.sf(f, groups - 1, n - groups)
+
+        return f, p
+
+    def two_way_from_stats(count:np.ndarray, total:np.ndarray, sumsq:np.ndarray) -> dict:
+        """
+        Public class method that performs two-way ANOVA with interaction (type II sums of squares) from the count, sum and sum of squares
+        of every cell, for all the tests along the leading axes at once. The two factors are the last two axes.
+        The additive model is fitted by weighted least squares on the cell means, so no design matrix over the raw values is built.
+
+        Parameters
+        ----------
+        count : np.ndarray
+            The number of values in every cell, with shape (..., levels of A, levels of B).
+        total : np.ndarray
+            The sum of the values in every cell.
+        sumsq : np.ndarray
+            The sum of the squared values in every cell.
+
+        Returns
+        -------
+        dict
+            The sums of squares ('ss'), degrees of freedom ('df'), F-values ('f') and p-values ('p'),
+            each with shape (..., 4) for the terms A, B, A:B and residual.
+        """
+        from scipy.stats import f as f_dist
+
+        levels_a, levels_b = count.shape[-2:]
+        count, total, sumsq = (np.asarray(array, dtype=np.float64) for array in (count, total, sumsq))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # center on the grand mean so that the sums of squares do not lose precision
+            n = count.sum(axis=(-2, -1))
+            grand_mean = total.sum(axis=(-2, -1)) / n
+            mean = grand_mean[..., None, None]
+            sumsq = sumsq - 2 * mean * total + count * mean * mean
+            total = total - count * mean
+
+            cells = count > 0
+            sumsq_all = sumsq.sum(axis=(-2, -1))
+            ss_within = sumsq_all - np.where(cells, total * total / count, 0.0).sum(axis=(-2, -1))
+
+            # models with one factor only
+            count_a, total_a = count.sum(axis=-1), total.sum(axis=-1)
+            count_b, total_b = count.sum(axis=-2), total.sum(axis=-2)
+            rss_a = sumsq_all - np.where(count_a > 0, total_a * total_a / count_a, 0.0).sum(axis=-1)
+            rss_b = sumsq_all - np.where(count_b > 0, total_b * total_b / count_b, 0.0).sum(axis=-1)
+
+            # additive model, normal equations on the cells, the pseudo-inverse takes care of the redundant parameter
+            normal = np.zeros(count.shape[:-2] + (levels_a + levels_b, levels_a + levels_b))
+            normal[..., np.arange(levels_a), np.arange(levels_a)] = count_a
+            normal[..., levels_a + np.arange(levels_b), levels_a + np.arange(levels_b)] = count_b
+            normal[..., :levels_a, levels_a:] = count
+            normal[..., levels_a:, :levels_a] = np.swapaxes(count, -2, -1)
+            right = np.concatenate([total_a, total_b], axis=-1)
+            coefficients = (np.linalg.pinv(normal) @ right[..., None])[..., 0]
+            rss_ab = sumsq_all - (coefficients * right).sum(axis=-1)
+
+            nonempty_a = (count_a > 0).sum(axis=-1)
+            nonempty_b = (count_b > 0).sum(axis=-1)
+            nonempty_cells = cells.sum(axis=(-2, -1))
+
+            ss = np.stack([rss_b - rss_ab, rss_a - rss_ab, rss_ab - ss_within, ss_within], axis=-1)
+            df = np.stack([nonempty_a - 1, nonempty_b - 1, nonempty_cells - nonempty_a - nonempty_b + 1, n - nonempty_cells], axis=-1).astype(float)
+
+            f = (ss / df) / (ss[..., 3:] / df[..., 3:])
+            f[..., 3] = np.nan
+            p = f_dist.sf(f, df, df[..., 3:])
+
+        return {'ss': ss, 'df': df, 'f': f, 'p': p}
+
+    def block_anova(city:str, data, agg:str='hourly', block:int=1, writer:ReportWriter=None, store:ResultsStore=None):
+        """
+        Public class method that performs ANOVA analysis on the data to check if the means of the data are different for different blocks of years
+        and saves the results to results folder. The statistics are answered from the cube of the data.
 
         Parameters
         ----------
         city : str
             The city name.
-        data : pd.DataFrame
-            The data in a pandas DataFrame.
+        data : pd.DataFrame or Cube
+            The data in a pandas DataFrame, or its cube.
         agg : str
             The aggregation level of the data. Default is 'hourly'. Can be 'daily' or 'hourly'.
+        block : int
+            The number of years in a block. Default is 1, every year is its own group.
+        writer : ReportWriter
+            The writer that writes the results workbook. Default is None, the workbook is written right away.
+        store : ResultsStore
+            The store the results are also written to. Default is None, the results are only written to the workbook.
 
         Returns
         -------
         None
         """
-        from scipy.stats import f_oneway
+        cube = Cube.of(data)
 
-        data = data.copy()
-
-        logging.info(f"Performing ANOVA for {agg} data for {city}.")
-
-        data_anova = {}
+        file_name = f'results/{city}/{agg}_anova.xlsx' if block == 1 else f'results/{city}/{block}Yblocks_{agg}_anova.xlsx'
 
         if agg == 'hourly':
-            for month in range(1, 13):
-                data_anova[month] = []
-                for hour in range(24):
-                    data_list = [list(data[(data['local_time'].dt.year == year) & (data['local_time'].dt.month == month) & (data['local_time'].dt.hour == hour)]['electricity']) for year in range(1980, 2024)]
-                    f, p = f_oneway(*data_list)
-                    data_anova[month].append([f, p])
-
-            data_anova = pd.DataFrame(data_anova, index=range(24))
+            f, p = ANOVA.oneway_from_stats(*cube.stats(('block', 'month', 'hour'), block=block))
 
             # store f-values in one sheet and p-values in another
-            f_values = data_anova.applymap(lambda x: x[0])
-            p_values = data_anova.applymap(lambda x: x[1])
+            f_values = pd.DataFrame(f.T, index=range(24), columns=range(1, 13))
+            p_values = pd.DataFrame(p.T, index=range(24), columns=range(1, 13))
 
-            f_values.to_excel(f'results/{city}/{agg}_anova.xlsx', sheet_name='F-Values')
+            (writer or ReportWriter(background=False)).write(file_name, {'F-Values': f_values, 'P-Values': p_values})
 
-            with pd.ExcelWriter(f'results/{city}/{agg}_anova.xlsx', engine='openpyxl', mode='a') as writer:
-                p_values.to_excel(writer, sheet_name='P-Values')
-
-            logging.info(f"ANOVA for {agg} data for {city} performed and results saved to results/{city}/{agg}_anova.xlsx.")
+            results = pd.DataFrame({'month': np.repeat(np.arange(1, 13), 24), 'hour': np.tile(np.arange(24), 12), 'statistic': f.ravel(), 'p': p.ravel()})
 
         elif agg == 'daily':
-            data['local_time'] = data['local_time'].dt.date
-            data = data.groupby('local_time').sum()
-            data.reset_index(inplace=True)
-            data['local_time'] = pd.to_datetime(data['local_time'])
+            f, p = ANOVA.oneway_from_stats(*cube.stats(('block', 'month'), 'daily', block=block))
 
-            for month in range(1, 13):
-                data_list = [list(data[(data['local_time'].dt.year == year) & (data['local_time'].dt.month == month)]['electricity']) for year in range(1980, 2024)]
-                f, p = f_oneway(*data_list)
-                data_anova[month] = {'f': f, 'p': p}
+            (writer or ReportWriter(background=False)).write(file_name, {'Sheet1': pd.DataFrame([f, p], index=['f', 'p'], columns=range(1, 13))})
 
-            pd.DataFrame(data_anova).to_excel(f'results/{city}/{agg}_anova.xlsx')
+            results = pd.DataFrame({'month': np.arange(1, 13), 'statistic': f, 'p': p})
 
-            logging.info(f"ANOVA for {agg} data for {city} performed and results saved to results/{city}/{agg}_anova.xlsx.")
-            
         else:
             logging.error(f"Aggregation level {agg} is not supported.")
             raise ValueError
 
+        if store is not None:
+            store.put(city, f'anova_{agg}' if block == 1 else f'anova_{agg}_{block}Y', results)
 
-    def fourYblocks_anova(city:str, data:pd.DataFrame, agg:str='hourly'):
+    def normal_anova(city:str, data, agg:str='hourly', writer:ReportWriter=None, store:ResultsStore=None):
         """
-        Public class method that performs ANOVA analysis on the data to check if the means of the data (for a given 4-year block) are different for different years
+        Public class method that performs ANOVA analysis on the data to check if the means of the data are different for different years
         and saves the results to results folder.
 
         Parameters
         ----------
         city : str
             The city name.
-        data : pd.DataFrame
-            The data in a pandas DataFrame.
+        data : pd.DataFrame or Cube
+            The data in a pandas DataFrame, or its cube.
         agg : str
             The aggregation level of the data. Default is 'hourly'. Can be 'daily' or 'hourly'.
+        writer : ReportWriter
+            The writer that writes the results workbook. Default is None, the workbook is written right away.
+        store : ResultsStore
+            The store the results are also written to. Default is None, the results are only written to the workbook.
 
         Returns
         -------
         None
         """
-        from scipy.stats import f_oneway
+        logging.info(f"Performing ANOVA for {agg} data for {city}.")
 
-        logging.info(f"Performing ANOVA for 4-year blocks for {city} for {agg} data.")
+        ANOVA.block_anova(city, data, agg, 1, writer, store)
 
-        data = data.copy()
+        logging.info(f"ANOVA for {agg} data for {city} performed and results saved to results/{city}/{agg}_anova.xlsx.")
 
-        data_anova = {}
+    def fourYblocks_anova(city:str, data, agg:str='hourly', writer:ReportWriter=None, store:ResultsStore=None):
+        """
+        Public class method that performs ANOVA analysis on the data to check if the means of the data (for a given 4-year block) are different for different years
+        and saves the results to results folder.
 
-        if agg == 'hourly':
-            for month in range(1, 13):
-                data_anova[month] = []
-                for hour in range(24):
-                    data_list = [list(data[(data['local_time'].dt.year == year) & (data['local_time'].dt.month == month) & (data['local_time'].dt.hour == hour)]['electricity']) for year in range(1980, 2024)]
-                    # make further 4 year groups in the data
-                    # each year element is already in a list, so make a big list with the 4 year data
-                    data_list = [data_list[i]+data_list[i+1]+data_list[i+2]+data_list[i+3] for i in range(0, len(data_list), 4)]
+        Parameters
+        ----------
+        city : str
+            The city name.
+        data : pd.DataFrame or Cube
+            The data in a pandas DataFrame, or its cube.
+        agg : str
+            The aggregation level of the data. Default is 'hourly'. Can be 'daily' or 'hourly'.
+        writer : ReportWriter
+            The writer that writes the results workbook. Default is None, the workbook is written right away.
+        store : ResultsStore
+            The store the results are also written to. Default is None, the results are only written to the workbook.
 
-                    f, p = f_oneway(*data_list)
-                    data_anova[month].append([f, p])
+        Returns
+        -------
+        None
+        """
+        logging.info(f"Performing ANOVA for 4-year blocks for {city} for {agg} data.")
 
-            data_anova = pd.DataFrame(data_anova, index=range(24))
+        ANOVA.block_anova(city, data, agg, 4, writer, store)
 
-            # store f-values in one sheet and p-values in another
-            f_values = data_anova.applymap(lambda x: x[0])
-            p_values = data_anova.applymap(lambda x: x[1])
+        logging.info(f"ANOVA ({agg}) for 4-year blocks for {city} performed and results saved to results folder.")
 
-            f_values.to_excel(f'results/{city}/4Yblocks_{agg}_anova.xlsx', sheet_name='F-Values')
-                            
-            with pd.ExcelWriter(f'results/{city}/4Yblocks_{agg}_anova.xlsx', engine='openpyxl', mode='a') as writer:
-                p_values.to_excel(writer, sheet_name='P-Values')
-
-            logging.info(f"ANOVA ({agg}) for 4-year blocks for {city} performed and results saved to results folder.")
+    def elevenYblocks_anova(city:str, data, agg:str='hourly', writer:ReportWriter=None, store:ResultsStore=None):
+        """
+        Public class method that performs ANOVA analysis on the data to check if the means of the data (for a given 11-year block) are different for different years
+        and saves the results to results folder.
 
-        elif agg == 'daily':
-            data['local_time'] = data['local_time'].dt.date
-            data = data.groupby('local_time').sum()
-            data.reset_index(inplace=True)
-            data['local_time'] = pd.to_datetime(data['local_time'])
+        Parameters
+        ----------
+        city : str
+            The city name.
+        data : pd.DataFrame or Cube
+            The data in a pandas DataFrame, or its cube.
+        agg : str
+            The aggregation level of the data. Default is 'hourly'. Can be 'daily' or 'hourly'.
+        writer : ReportWriter
+            The writer that writes the results workbook. Default is None, the workbook is written right away.
+        store : ResultsStore
+            The store the results are also written to. Default is None, the results are only written to the workbook.
 
-            data_anova = {}
+        Returns
+        -------
+        None
+        """
+        logging.info(f"Performing ANOVA for 11-year blocks for {city} for {agg} data.")
 
-            for month in range(1, 13):
-                data_list = [list(data[(data['local_time'].dt.year == year) & (data['local_time'].dt.month == month)]['electricity']) for year in range(1980, 2024)]
-                # make further 4 year groups in the data
-                # each year element is already in a list, so make a big list with the 4 year data
-                data_list = [data_list[i]+data_list[i+1]+data_list[i+2]+data_list[i+3] for i in range(0, len(data_list), 4)]
+        ANOVA.block_anova(city, data, agg, 11, writer, store)
 
-                f, p = f_oneway(*data_list)
-                data_anova[month] = {'f': f, 'p': p}
+        logging.info(f"ANOVA ({agg}) for 11-year blocks for {city} performed and results saved to results/{city}/11Yblocks_anova.xlsx.")
 
-            pd.DataFrame(data_anova).to_excel(f'results/{city}/4Yblocks_{agg}_anova.xlsx')
+    def anova_table(result:dict, index:list, terms:list) -> pd.DataFrame:
+        """
+        Public class method that turns the result of two_way_from_stats into a long table, one row per test and term.
 
-            logging.info(f"ANOVA ({agg}) for 4-year blocks for {city} performed and results saved to results folder.")
+        Parameters
+        ----------
+        result : dict
+            The result of two_way_from_stats.
+        index : list
+            The labels of every leading axis of the result, with the name of the axis, as (name, labels) pairs.
+        terms : list
+            The names of the four terms.
 
-        else:
-            logging.error(f"Aggregation level {agg} is not supported.")
-            raise ValueError
+        Returns
+        -------
+        pd.DataFrame
+            The sums of squares, degrees of freedom, F-values and p-values, indexed by the leading axes and the term.
+        """
+        names = [name for name, _ in index] + ['term']
+        rows = pd.MultiIndex.from_product([labels for _, labels in index] + [terms], names=names)
 
+        return pd.DataFrame({'SS': result['ss'].ravel(), 'df': result['df'].ravel(), 'F': result['f'].ravel(), 'p': result['p'].ravel()}, index=rows)
 
-    def elevenYblocks_anova(city:str, data:pd.DataFrame, agg:str='hourly'):
+    def two_way_anova(cubes:dict, agg:str='daily', factors:tuple=('year', 'month'), block:int=None, writer:ReportWriter=None, store:ResultsStore=None) -> pd.DataFrame:
         """
-        Public class method that performs ANOVA analysis on the data to check if the means of the data (for a given 11-year block) are different for different years
-        and saves the results to results folder.
+        Public class method that performs two-way ANOVA with interaction, by default with the year and the month as factors,
+        for all the sites at once (and all the hours for hourly data) and saves the results to results folder.
+        The statistics are answered from the cubes of the sites.
 
         Parameters
         ----------
-        city : str
-            The city name.
-        data : pd.DataFrame
-            The data in a pandas DataFrame.
+        cubes : dict
+            The data of every site, as a pandas DataFrame or its cube, by site name.
         agg : str
-            The aggregation level of the data. Default is 'hourly'. Can be 'daily' or 'hourly'.
+            The aggregation level of the data. Default is 'daily'. Can be 'daily' (one test per site on the daily totals)
+            or 'hourly' (one test per site and hour on the hourly values).
+        factors : tuple
+            The two factors, dimensions of the cube. Default is ('year', 'month').
+        block : int
+            The block length in years, if a factor is 'block'. Default is None.
+        writer : ReportWriter
+            The writer that writes the results workbook. Default is None, the workbook is written right away.
+        store : ResultsStore
+            The store the results are also written to. Default is None, the results are only written to the workbook.
 
         Returns
         -------
-        None
+        pd.DataFrame
+            The ANOVA table, indexed by site, hour (for hourly data) and term.
         """
-        from scipy.stats import f_oneway
+        logging.info(f"Performing two-way ANOVA ({' x '.join(factors)}) for {agg} data for {', '.join(cubes)}.")
 
-        logging.info(f"Performing ANOVA for 11-year blocks for {city} for {agg} data.")
+        if agg not in ('hourly', 'daily'):
+            logging.error(f"Aggregation level {agg} is not supported.")
+            raise ValueError
 
-        data = data.copy()
+        cubes = {site: Cube.of(data) for site, data in cubes.items()}
+        years = np.arange(min(cube.years[0] for cube in cubes.values()), max(cube.years[-1] for cube in cubes.values()) + 1)
+        by = ('hour',) if agg == 'hourly' else ()
 
-        data_anova = {}
+        stats = [cube.stats(by + tuple(factors), agg, block, years) for cube in cubes.values()]
+        result = ANOVA.two_way_from_stats(*(np.stack(arrays) for arrays in zip(*stats)))
 
-        if agg == 'hourly':
-            for month in range(1, 13):
-                data_anova[month] = []
-                for hour in range(24):
-                    data_list = [list(data[(data['local_time'].dt.year == year) & (data['local_time'].dt.month == month) & (data['local_time'].dt.hour == hour)]['electricity']) for year in range(1980, 2024)]
-                    # make further 11 year groups in the data
-                    # each year element is already in a list, so make a big list with the 11 year data
-                    data_list = [data_list[i]+data_list[i+1]+data_list[i+2]+data_list[i+3]+data_list[i+4]+data_list[i+5]+data_list[i+6]+data_list[i+7]+data_list[i+8]+data_list[i+9]+data_list[i+10] for i in range(0, len(data_list), 11)]
+        index = [('site', list(cubes))] + ([('hour', list(range(24)))] if agg == 'hourly' else [])
+        table = ANOVA.anova_table(result, index, [factors[0], factors[1], f'{factors[0]}:{factors[1]}', 'Residual'])
 
-                    f, p = f_oneway(*data_list)
-                    data_anova[month].append([f, p])
+        file_name = f'results/two_way_{agg}_anova.xlsx'
+        (writer or ReportWriter(background=False)).write(file_name, {'ANOVA': table})
 
-            data_anova = pd.DataFrame(data_anova, index=range(24))
+        if store is not None:
+            results = table.reset_index().rename(columns={'F': 'statistic'})[[*table.index.names, 'statistic', 'p']]
+            store.put('all', f'two_way_{agg}', results)
 
-            # store f-values in one sheet and p-values in another
-            f_values = data_anova.applymap(lambda x: x[0])
-            p_values = data_anova.applymap(lambda x: x[1])
+        logging.info(f"Two-way ANOVA for {agg} data performed and results saved to {file_name}.")
+        return table
+
+    def cross_site_anova(cubes:dict, agg:str='hourly', factor:str='year', block:int=None, writer:ReportWriter=None, store:ResultsStore=None) -> pd.DataFrame:
+        """
+        Public class method that compares the sites with two-way ANOVA with interaction, with the site and by default the year as factors,
+        for every month (and hour for hourly data) at once, and saves the results to results folder.
+        The site term tests whether the sites differ, the interaction term whether the sites change differently over the years.
 
-            f_values.to_excel(f'results/{city}/11Yblocks_{agg}_anova.xlsx', sheet_name='F-Values')
-                            
-            with pd.ExcelWriter(f'results/{city}/11Yblocks_{agg}_anova.xlsx', engine='openpyxl', mode='a') as writer:
-                p_values.to_excel(writer, sheet_name='P-Values')
+        Parameters
+        ----------
+        cubes : dict
+            The data of every site, as a pandas DataFrame or its cube, by site name.
+        agg : str
+            The aggregation level of the data. Default is 'hourly'. Can be 'daily' or 'hourly'.
+        factor : str
+            The second factor, a dimension of the cube. Default is 'year'.
+        block : int
+            The block length in years, if the factor is 'block'. Default is None.
+        writer : ReportWriter
+            The writer that writes the results workbook. Default is None, the workbook is written right away.
+        store : ResultsStore
+            The store the results are also written to. Default is None, the results are only written to the workbook.
 
-            logging.info(f"ANOVA ({agg}) for 11-year blocks for {city} performed and results saved to results/{city}/11Yblocks_anova.xlsx.")
+        Returns
+        -------
+        pd.DataFrame
+            The ANOVA table, indexed by month, hour (for hourly data) and term.
+        """
+        logging.info(f"Performing cross-site ANOVA (site x {factor}) for {agg} data for {', '.join(cubes)}.")
 
-        elif agg == 'daily':
-            data['local_time'] = data['local_time'].dt.date
-            data = data.groupby('local_time').sum()
-            data.reset_index(inplace=True)
-            data['local_time'] = pd.to_datetime(data['local_time'])
+        if agg not in ('hourly', 'daily') or len(cubes) < 2:
+            logging.error("Cross-site ANOVA needs hourly or daily data and at least two sites.")
+            raise ValueError
 
-            data_anova = {}
+        cubes = {site: Cube.of(data) for site, data in cubes.items()}
+        years = np.arange(min(cube.years[0] for cube in cubes.values()), max(cube.years[-1] for cube in cubes.values()) + 1)
+        by = ('month', 'hour') if agg == 'hourly' else ('month',)
 
-            for month in range(1, 13):
-                data_list = [list(data[(data['local_time'].dt.year == year) & (data['local_time'].dt.month == month)]['electricity']) for year in range(1980, 2024)]
-                # make further 11 year groups in the data
-                # each year element is already in a list, so make a big list with the 11 year data
-                data_list = [data_list[i]+data_list[i+1]+data_list[i+2]+data_list[i+3]+data_list[i+4]+data_list[i+5]+data_list[i+6]+data_list[i+7]+data_list[i+8]+data_list[i+9]+data_list[i+10] for i in range(0, len(data_list), 11)]
+        # the sites are stacked as the first factor, just before the second one
+        stats = [cube.stats(by + (factor,), agg, block, years) for cube in cubes.values()]
+        result = ANOVA.two_way_from_stats(*(np.stack(arrays, axis=-2) for arrays in zip(*stats)))
 
-                f, p = f_oneway(*data_list)
-                data_anova[month] = {'f': f, 'p': p}
+        index = [('month', list(range(1, 13)))] + ([('hour', list(range(24)))] if agg == 'hourly' else [])
+        table = ANOVA.anova_table(result, index, ['site', factor, f'site:{factor}', 'Residual'])
 
-            pd.DataFrame(data_anova).to_excel(f'results/{city}/11Yblocks_{agg}_anova.xlsx')
+        file_name = f'results/cross_site_{agg}_anova.xlsx'
+        (writer or ReportWriter(background=False)).write(file_name, {'ANOVA': table})
 
-            logging.info(f"ANOVA ({agg}) for 11-year blocks for {city} performed and results saved to results/{city}/11Yblocks_anova.xlsx.")
+        if store is not None:
+            results = table.reset_index().rename(columns={'F': 'statistic'})[[*table.index.names, 'statistic', 'p']]
+            store.put('all', f'cross_site_{agg}', results)
 
-        else:
-            logging.error(f"Aggregation level {agg} is not supported.")
-            raise ValueError
\ No newline at end of file
+        logging.info(f"Cross-site ANOVA for {agg} data performed and results saved to {file_name}.")
+        return table
@@ -0,0 +1,461 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+import kernel_utils
+from utils import hourly_grid, is_hourly_grid, year_blocks
+
+class Cube():
+    """
+    Class that stores the count, sum and sum of squares of the data at the (year, month, day, hour) grain,
+    together with materialized rollups, so that grouped statistics can be answered without going back to the raw data.
+    """
+
+    DIMS = ('year', 'month', 'day', 'hour')
+
+    # derived dimensions and the base dimension they group
+    DERIVED = {'quarter': 'month', 'season': 'month', 'block': 'year'}
+
+    # rollups that are computed when the cube is built and stored with it
+    ROLLUPS = [
+        (('year', 'month', 'hour'), 'hourly'),
+        (('year', 'month'), 'hourly'),
+        (('year',), 'hourly'),
+        (('year', 'month'), 'daily'),
+        (('year',), 'daily'),
+    ]
+
+    def __init__(self, years, count:np.ndarray, total:np.ndarray, sumsq:np.ndarray, rollups:dict=None):
+        """
+        Constructor for the Cube class.
+
+        Parameters
+        ----------
+        years : array-like
+            The years along the first axis of the cube.
+        count : np.ndarray
+            The number of values in every (year, month, day, hour) cell.
+        total : np.ndarray
+            The sum of the values in every cell.
+        sumsq : np.ndarray
+            The sum of the squared values in every cell.
+        rollups : dict
+            Already computed rollups, keyed by (dims, measure, block, years). Default is None.
+
+        The arrays are stored in the precision selected in kernel_utils.
+        """
+        dtype = kernel_utils.float_type()
+        self.years = np.asarray(years, dtype=int)
+        self.count = np.asarray(count, dtype=dtype)
+        self.total = np.asarray(total, dtype=dtype)
+        self.sumsq = np.asarray(sumsq, dtype=dtype)
+        self.rollups = {key: tuple(np.asarray(array, dtype=dtype) for array in rollup) for key, rollup in (rollups or {}).items()}
+
+    def from_data(data:pd.DataFrame, col:str='electricity', year_range:list=None) -> 'Cube':
+        """
+        Public class method that builds the cube from the hourly data in one pass and materializes the standard rollups.
+        Clean data (see utils.validate_hourly) that is still the full hourly grid of its years (see utils.is_hourly_grid)
+        takes the contiguous grid path instead of grouping by timestamps.
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            The data in a pandas DataFrame, with a datetime 'local_time' column.
+        col : str
+            The column to aggregate. Default is 'electricity'.
+        year_range : list
+            The first and last year of the cube, rows outside of it are left out. Default is None, all the years of the data.
+
+        Returns
+        -------
+        Cube
+            The cube of the data.
+        """
+        logging.info(f"Building cube of {col} from {len(data)} rows.")
+
+        grid = data.attrs.get('clean') and is_hourly_grid(data)
+        if data.attrs.get('clean') and not grid:
+            logging.warning("The data is marked clean but is not the full hourly grid of its years anymore, its timestamps are grouped instead.")
+
+        if grid:
+            years, count, total, sumsq = Cube.from_grid(*hourly_grid(data, col), year_range)
+
+        else:
+            time = data['local_time'].dt
+            year = time.year.to_numpy()
+            values = data[col].to_numpy(dtype=float)
+
+            if year_range is None:
+                year_range = [year.min(), year.max()]
+            years = np.arange(year_range[0], year_range[1] + 1)
+
+            # rows outside the years get the code -1, they and the missing values are left out like in pandas' mean
+            inside = (year >= years[0]) & (year <= years[-1])
+            shape = (len(years), 12, 31, 24)
+
+            cell = np.full(len(values), -1)
+            cell[inside] = np.ravel_multi_index((year[inside] - years[0], time.month.to_numpy()[inside] - 1, time.day.to_numpy()[inside] - 1, time.hour.to_numpy()[inside]), shape)
+
+            count, total, sumsq = (array.reshape(shape) for array in kernel_utils.group_stats(cell, values, int(np.prod(shape))))
+
+        cube = Cube(years, count, total, sumsq)
+        cube.materialize()
+
+        logging.info(f"Cube built for years {years[0]} to {years[-1]}.")
+        return cube
+
+    def from_grid(grid_years:np.ndarray, grid:np.ndarray, year_range:list=None) -> tuple:
+        """
+        Public class method that computes the cube arrays from a contiguous (years, 8784) hourly grid (see utils.hourly_grid),
+        by placing every hour of the year at its precomputed (month, day, hour) cell instead of decomposing timestamps.
+
+        Parameters
+        ----------
+        grid_years : np.ndarray
+            The years of the rows of the grid.
+        grid : np.ndarray
+            The hourly values, with shape (years, 8784).
+        year_range : list
+            The first and last year of the cube. Default is None, the years of the grid.
+
+        Returns
+        -------
+        tuple
+            The years and the count, sum and sum of squares arrays of the cube.
+        """
+        if year_range is None:
+            year_range = [grid_years[0], grid_years[-1]]
+        years = np.arange(year_range[0], year_range[1] + 1)
+
+        # the (month, day, hour) cell of every hour of a leap and a non-leap year
+        templates = {}
+        for leap, reference in ((True, 2000), (False, 2001)):
+            hours = pd.date_range(f'{reference}-01-01', f'{reference}-12-31 23:00', freq='h')
+            templates[leap] = np.ravel_multi_index((hours.month - 1, hours.day - 1, hours.hour), (12, 31, 24))
+
+        dtype = kernel_utils.float_type()
+        count = np.zeros((len(years), 12 * 31 * 24), dtype=dtype)
+        total = np.zeros((len(years), 12 * 31 * 24), dtype=dtype)
+        sumsq = np.zeros((len(years), 12 * 31 * 24), dtype=dtype)
+
+        for row, year in enumerate(grid_years):
+            if year < years[0] or year > years[-1]:
+                continue
+            template = templates[year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)]
+            values = grid[row, :len(template)]
+            # missing values are left out, same as pandas' mean
+            present = ~np.isnan(values)
+            count[year - years[0], template] = present
+            total[year - years[0], template] = np.where(present, values, 0.0)
+            sumsq[year - years[0], template] = np.where(present, values * values, 0.0)
+
+        shape = (len(years), 12, 31, 24)
+        return years, count.reshape(shape), total.reshape(shape), sumsq.reshape(shape)
+
+    def of(data) -> 'Cube':
+        """
+        Public class method that returns the cube of the data, building it for the 1980-2023 study period if the data is not a cube already.
+
+        Parameters
+        ----------
+        data : pd.DataFrame or Cube
+            The data in a pandas DataFrame, or its cube.
+
+        Returns
+        -------
+        Cube
+            The cube of the data.
+        """
+        if isinstance(data, Cube):
+            return data
+        return Cube.from_data(data, year_range=[1980, 2023])
+
+    def materialize(self):
+        """
+        Public method that computes the standard rollups so that they are stored with the cube.
+
+        Returns
+        -------
+        None
+        """
+        for dims, measure in Cube.ROLLUPS:
+            self.stats(dims, measure)
+
+    def base(self, measure:str='hourly'):
+        """
+        Public method that returns the finest grain arrays for a measure.
+        For the 'hourly' measure every hourly value is one observation, on the (year, month, day, hour) grain.
+        For the 'daily' measure every daily total is one observation, on the (year, month, day) grain.
+
+        Parameters
+        ----------
+        measure : str
+            The measure. Default is 'hourly'. Can be 'hourly' or 'daily'.
+
+        Returns
+        -------
+        tuple
+            The dimension names and the count, sum and sum of squares arrays.
+        """
+        if measure == 'hourly':
+            return Cube.DIMS, self.count, self.total, self.sumsq
+
+        elif measure == 'daily':
+            key = (Cube.DIMS[:3], 'daily', None, None)
+            if key not in self.rollups:
+                daily_total = kernel_utils.reduce_sum(self.total, 3)
+                days = (kernel_utils.reduce_sum(self.count, 3) > 0).astype(self.total.dtype)
+                self.rollups[key] = (days, daily_total, daily_total * daily_total)
+            return (Cube.DIMS[:3],) + self.rollups[key]
+
+        else:
+            logging.error(f"Measure {measure} is not supported.")
+            raise ValueError
+
+    def codes(self, dim:str, block:int=None, years=None) -> tuple:
+        """
+        Public method that returns, for a derived dimension, the group of every element of its base dimension and the group labels.
+
+        Parameters
+        ----------
+        dim : str
+            The derived dimension. Can be 'quarter', 'season' or 'block'.
+        block : int
+            The block length in years, for the 'block' dimension. Default is None.
+        years : array-like
+            The years the blocks are made of. Default is None, all the years of the cube.
+
+        Returns
+        -------
+        tuple
+            The group codes and the group labels.
+        """
+        if dim == 'quarter':
+            return np.arange(12) // 3, ['Q1', 'Q2', 'Q3', 'Q4']
+
+        elif dim == 'season':
+            # meteorological seasons, December is counted with the same calendar year
+            return np.array([0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0]), ['DJF', 'MAM', 'JJA', 'SON']
+
+        elif dim == 'block':
+            if block is None:
+                logging.error("The 'block' dimension needs a block length.")
+                raise ValueError
+            return year_blocks(self.years if years is None else years, block)
+
+        else:
+            logging.error(f"Dimension {dim} is not supported.")
+            raise ValueError
+
+    def labels(self, dim:str, block:int=None, years=None) -> list:
+        """
+        Public method that returns the labels along a dimension.
+
+        Parameters
+        ----------
+        dim : str
+            The dimension.
+        block : int
+            The block length in years, for the 'block' dimension. Default is None.
+        years : array-like
+            The selected years. Default is None, all the years of the cube.
+
+        Returns
+        -------
+        list
+            The labels along the dimension.
+        """
+        if dim == 'year':
+            return list(self.years if years is None else years)
+        elif dim == 'month':
+            return list(range(1, 13))
+        elif dim == 'day':
+            return list(range(1, 32))
+        elif dim == 'hour':
+            return list(range(24))
+        return self.codes(dim, block, years)[1]
+
+    def stats(self, dims:tuple, measure:str='hourly', block:int=None, years=None) -> tuple:
+        """
+        Public method that returns the count, sum and sum of squares of the data grouped by the given dimensions.
+        Base dimensions are 'year', 'month', 'day' and 'hour', derived dimensions are 'quarter', 'season' and 'block'.
+        The result is computed from the smallest materialized rollup that contains the needed dimensions, and is kept as a rollup itself.
+
+        Parameters
+        ----------
+        dims : tuple
+            The dimensions to group by, in the order of the returned axes.
+        measure : str
+            The measure. Default is 'hourly'. Can be 'hourly' or 'daily'.
+        block : int
+            The block length in years, for the 'block' dimension. Default is None.
+        years : array-like
+            The years to keep. Years outside the cube are left empty. Default is None, all the years of the cube.
+
+        Returns
+        -------
+        tuple
+            The count, sum and sum of squares arrays, with one axis per dimension.
+        """
+        dims = tuple(dims)
+        years = None if years is None else tuple(int(year) for year in years)
+        key = (dims, measure, block, years)
+        if key in self.rollups:
+            return self.rollups[key]
+
+        base_dims, count, total, sumsq = self.base(measure)
+
+        bases = [Cube.DERIVED.get(dim, dim) for dim in dims]
+        if not set(bases) <= set(base_dims) or len(set(bases)) != len(bases):
+            logging.error(f"Dimensions {dims} are not supported for the {measure} measure.")
+            raise ValueError
+        needed = set(bases) | ({'year'} if years is not None else set())
+
+        # start from the smallest materialized rollup on base dimensions that has everything needed
+        source_dims, arrays = base_dims, [count, total, sumsq]
+        for (rollup_dims, rollup_measure, rollup_block, rollup_years), rollup in self.rollups.items():
+            if rollup_measure == measure and rollup_years is None and set(rollup_dims) <= set(base_dims) and needed <= set(rollup_dims) and rollup[0].size < arrays[0].size:
+                source_dims, arrays = rollup_dims, list(rollup)
+
+        if years is not None:
+            axis = source_dims.index('year')
+            selected = np.asarray(years)
+            inside = (selected >= self.years[0]) & (selected <= self.years[-1])
+            index = selected[inside] - self.years[0]
+            for i, array in enumerate(arrays):
+                shape = list(array.shape)
+                shape[axis] = len(selected)
+                restricted = np.zeros(shape, dtype=array.dtype)
+                np.moveaxis(restricted, axis, 0)[inside] = np.moveaxis(array, axis, 0)[index]
+                arrays[i] = restricted
+
+        # which source axis every requested dimension comes from
+        axes = [source_dims.index(Cube.DERIVED.get(dim, dim)) for dim in dims]
+
+        # group the source axis of every derived dimension
+        for dim, axis in zip(dims, axes):
+            if dim in Cube.DERIVED:
+                codes, labels = self.codes(dim, block, years)
+                onehot = np.zeros((len(codes), len(labels)), dtype=arrays[0].dtype)
+                onehot[np.arange(len(codes)), codes] = 1.0
+                arrays = [np.moveaxis(np.tensordot(array, onehot, axes=([axis], [0])), -1, axis) for array in arrays]
+
+        # sum over the dimensions that are not kept and put the kept ones in the requested order
+        dropped = tuple(axis for axis in range(len(source_dims)) if axis not in axes)
+        kept = sorted(axes)
+        arrays = tuple(np.transpose(kernel_utils.reduce_sum(array, dropped), [kept.index(axis) for axis in axes]) for array in arrays)
+
+        self.rollups[key] = arrays
+        return arrays
+
+    def to_frame(self, dims:tuple, measure:str='hourly', block:int=None, years=None) -> pd.DataFrame:
+        """
+        Public method that returns the grouped count, sum, sum of squares, mean and variance of the data as a DataFrame.
+
+        Parameters
+        ----------
+        dims : tuple
+            The dimensions to group by.
+        measure : str
+            The measure. Default is 'hourly'. Can be 'hourly' or 'daily'.
+        block : int
+            The block length in years, for the 'block' dimension. Default is None.
+        years : array-like
+            The years to keep. Default is None, all the years of the cube.
+
+        Returns
+        -------
+        pd.DataFrame
+            The grouped statistics, indexed by the dimensions. Empty groups are left out.
+        """
+        count, total, sumsq = self.stats(dims, measure, block, years)
+        index = pd.MultiIndex.from_product([self.labels(dim, block, years) for dim in dims], names=list(dims))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = total / count
+            var = (sumsq - total * mean) / (count - 1)
+
+        frame = pd.DataFrame({'count': count.ravel(), 'sum': total.ravel(), 'sumsq': sumsq.ravel(), 'mean': mean.ravel(), 'var': var.ravel()}, index=index)
+        return frame[frame['count'] > 0]
+
+    def mean(self, dims:tuple, measure:str='hourly', block:int=None, years=None) -> np.ndarray:
+        """
+        Public method that returns the grouped means of the data, NaN for empty groups.
+
+        Parameters
+        ----------
+        dims : tuple
+            The dimensions to group by.
+        measure : str
+            The measure. Default is 'hourly'. Can be 'hourly' or 'daily'.
+        block : int
+            The block length in years, for the 'block' dimension. Default is None.
+        years : array-like
+            The years to keep. Default is None, all the years of the cube.
+
+        Returns
+        -------
+        np.ndarray
+            The grouped means, with one axis per dimension.
+        """
+        count, total, _ = self.stats(dims, measure, block, years)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+    def save(self, path:str):
+        """
+        Public method that saves the cube and its materialized rollups to a compressed numpy file.
+
+        Parameters
+        ----------
+        path : str
+            The path to the file.
+
+        Returns
+        -------
+        None
+        """
+        arrays = {'years': self.years, 'count': self.count, 'total': self.total, 'sumsq': self.sumsq}
+        # rollups restricted to a selection of years are cheap to recompute and are not stored
+        for (dims, measure, block, years), rollup in self.rollups.items():
+            if years is not None:
+                continue
+            name = f"{measure}__{'.'.join(dims)}__{block or 0}"
+            arrays[f'{name}__count'], arrays[f'{name}__total'], arrays[f'{name}__sumsq'] = rollup
+
+        np.savez_compressed(path, **arrays)
+
+        logging.info(f"Cube saved to {path}.")
+
+    def load(path:str) -> 'Cube':
+        """
+        Public class method that loads a cube saved with Cube.save.
+
+        Parameters
+        ----------
+        path : str
+            The path to the file.
+
+        Returns
+        -------
+        Cube
+            The loaded cube.
+        """
+        if not os.path.exists(path):
+            logging.error(f"File {path} does not exist.")
+            raise FileNotFoundError
+
+        with np.load(path) as arrays:
+            rollups = {}
+            for name in arrays.files:
+                if name.endswith('__count'):
+                    measure, dims, block = name[:-len('__count')].split('__')
+                    prefix = name[:-len('count')]
+                    key = (tuple(dims.split('.')), measure, int(block) or None, None)
+                    rollups[key] = (arrays[prefix + 'count'], arrays[prefix + 'total'], arrays[prefix + 'sumsq'])
+
+            cube = Cube(arrays['years'], arrays['count'], arrays['total'], arrays['sumsq'], rollups)
+
+        logging.info(f"Cube loaded from {path}.")
+        return cube
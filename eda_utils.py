@@ -1,7 +1,14 @@
 import logging
 import os
+import numpy as np
 import pandas as pd
 
+import kernel_utils
+from cube_utils import Cube
+from utils import year_blocks
+from report_utils import ReportWriter
+from results_utils import ResultsStore
+
 class EDA():
     """
     Class that performs exploratory data analysis.
@@ -18,7 +25,7 @@ class EDA():
         """
         self.city = city
 
-    def calculate_monthly_means(city:str, data:pd.DataFrame, agg:str='hourly'):
+    def calculate_monthly_means(city:str, data, agg:str='hourly', writer:ReportWriter=None, store:ResultsStore=None):
         """
         Public class method that calculates the monthly means of the data and saves the data to monthly sheet in the excel file.
 
@@ -26,10 +33,14 @@ class EDA():
         ----------
         city : str
             The city name.
-        data : pd.DataFrame
-            The data in a pandas DataFrame.
+        data : pd.DataFrame or Cube
+            The data in a pandas DataFrame, or its cube.
         agg : str
             The aggregation level of the data. Default is 'hourly'. Can be 'daily' or 'hourly'.
+        writer : ReportWriter
+            The writer that writes the results workbook. Default is None, the workbook is written right away.
+        store : ResultsStore
+            The store the means are also written to, labelled by year. Default is None, the means are only written to the workbook.
 
         Returns
         -------
@@ -37,46 +48,38 @@ class EDA():
         """
         logging.info(f"Calculating monthly {agg} means for {city}.")
 
-        data = data.copy()
-
-        monthly_means = {}
+        cube = Cube.of(data)
+        years = cube.years
 
         if agg == 'hourly':
-            for month in range(1,13):
-                for hour in range(24):
-                    monthly_means[(month, hour)] = [data[(data['local_time'].dt.year == year) & (data['local_time'].dt.month == month) & (data['local_time'].dt.hour == hour)]['electricity'].mean() for year in range(1980, 2024)]
-            
-            monthly_means = pd.DataFrame(monthly_means, index=range(1980, 2024))
+            monthly_means = cube.mean(('year', 'month', 'hour')).reshape(len(years), 12 * 24)
+            monthly_means = pd.DataFrame(monthly_means, index=years, columns=pd.MultiIndex.from_product([range(1, 13), range(24)]))
 
             month_to_name = {1: 'January', 2: 'February', 3: 'March', 4: 'April', 5: 'May', 6: 'June', 7: 'July', 8: 'August', 9: 'September', 10: 'October', 11: 'November', 12: 'December'}
 
-            monthly_means.xs(1, level=0, axis=1).to_excel(f'transformed_data/{city}/monthly_{agg}_means.xlsx', sheet_name='January')
-            for month in range(2, 13):
-                # write to the same excel file
-                with pd.ExcelWriter(f'transformed_data/{city}/monthly_{agg}_means.xlsx', engine='openpyxl', mode='a') as writer:
-                    monthly_means.xs(month, level=0, axis=1).to_excel(writer, sheet_name=month_to_name[month])
+            # all the months are written to the same excel file in one pass
+            (writer or ReportWriter(background=False)).write(f'transformed_data/{city}/monthly_{agg}_means.xlsx',
+                                                             {month_to_name[month]: monthly_means.xs(month, level=0, axis=1) for month in range(1, 13)})
 
-            logging.info(f"Monthly {agg} means for {city} calculated and saved to transformed_data/{city}/monthly_{agg}_means.xlsx.")
+            results = pd.DataFrame({'label': np.repeat(years, 12 * 24), 'month': np.tile(np.repeat(np.arange(1, 13), 24), len(years)),
+                                    'hour': np.tile(np.arange(24), 12 * len(years)), 'value': monthly_means.to_numpy().ravel()})
 
         elif agg == 'daily':
-            data['local_time'] = data['local_time'].dt.date
-            data = data.groupby('local_time').sum()
-            data.reset_index(inplace=True)
-            data['local_time'] = pd.to_datetime(data['local_time'])
+            monthly_means = pd.DataFrame(cube.mean(('year', 'month'), 'daily'), index=years, columns=range(1, 13))
 
-            for month in range(1,13):
-                monthly_means[month] = [data[(data['local_time'].dt.year == year) & (data['local_time'].dt.month == month)]['electricity'].mean() for year in range(1980, 2024)]
+            (writer or ReportWriter(background=False)).write(f'transformed_data/{city}/monthly_{agg}_means.xlsx', {'Sheet1': monthly_means})
 
-            monthly_means = pd.DataFrame(monthly_means, index=range(1980, 2024))
-
-            monthly_means.to_excel(f'transformed_data/{city}/monthly_{agg}_means.xlsx')
-
-            logging.info(f"Monthly {agg} means for {city} calculated and saved to transformed_data/{city}/monthly_{agg}_means.xlsx.")
+            results = pd.DataFrame({'label': np.repeat(years, 12), 'month': np.tile(np.arange(1, 13), len(years)), 'value': monthly_means.to_numpy().ravel()})
 
         else:
             logging.error(f"Aggregation level {agg} is not supported.")
             raise ValueError
 
+        if store is not None:
+            store.put(city, f'monthly_{agg}_means', results)
+
+        logging.info(f"Monthly {agg} means for {city} calculated and saved to transformed_data/{city}/monthly_{agg}_means.xlsx.")
+
 
     def hourly_control_charts(city:str):
         """
@@ -98,10 +101,7 @@ class EDA():
 
         logging.info(f"Plotting hourly control charts for {city}.")
 
-        def make_sigma_plot(data, col, month):
-            # Calculate mean and standard deviation
-            mean = data[col].mean()
-            std = data[col].std()
+        def make_sigma_plot(data, col, month, mean, std):
 
             # Set Seaborn style
             sns.set(style="whitegrid")
@@ -142,8 +142,14 @@ class EDA():
 
         for sheet in sheet_names:
             data = pd.read_excel(f'transformed_data/{city}/monthly_hourly_means.xlsx', sheet_name=sheet, index_col=0)
-            for col in data.columns:
-                make_sigma_plot(data, col, sheet)        
+
+            # mean and standard deviation of every hour at once
+            codes = np.broadcast_to(np.arange(data.shape[1]), data.shape)
+            means = kernel_utils.group_mean(codes, data.to_numpy(dtype=float), data.shape[1])
+            stds = np.sqrt(kernel_utils.group_var(codes, data.to_numpy(dtype=float), data.shape[1]))
+
+            for i, col in enumerate(data.columns):
+                make_sigma_plot(data, col, sheet, means[i], stds[i])
 
         logging.info(f"Hourly control charts for {city} plotted and saved to visualizations/sigma_plots.")
 
@@ -178,7 +184,7 @@ class EDA():
             plt.xticks(rotation=45)
             plt.tight_layout()
             plt.savefig(f'visualizations/{city}/box_plots/{sheet}_box_plot.png')
-            plt.close
+            plt.close()
 
         logging.info(f"Hourly box plots for {city} plotted and saved to visualizations/box_plots.")
 
@@ -221,57 +227,253 @@ class EDA():
 
         logging.info(f"Daily mean plots for {city} plotted and saved to visualizations folder.")
 
-    def yearly_plots(city:str, data:pd.DataFrame, agg:int = 1):
+    def box_plot_stats(data:pd.DataFrame, whis:float=1.5) -> list:
         """
-        Public class method that plots hourly box plots for the data and saves the plots to visualizations folder.
+        Public class method that computes the box plot statistics of every column of the data in one vectorized pass,
+        in the format expected by matplotlib's Axes.bxp (same quartiles and whiskers as seaborn's boxplot).
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            The data in a pandas DataFrame, one box per column.
+        whis : float
+            The whisker length as a multiple of the interquartile range. Default is 1.5.
+
+        Returns
+        -------
+        list
+            One dictionary of box plot statistics per column.
+        """
+        values = data.to_numpy(dtype=float)
+
+        # every column is a group
+        codes = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+        q1, med, q3 = kernel_utils.group_quantile(codes, values, values.shape[1], [0.25, 0.5, 0.75])
+        iqr = q3 - q1
+
+        # whiskers end at the most extreme data points inside the fences, everything else is a flier
+        inside = (values >= q1 - whis * iqr) & (values <= q3 + whis * iqr)
+        low, high = kernel_utils.group_minmax(codes, np.where(inside, values, np.nan), values.shape[1])
+        whislo = np.fmin(low, q1)
+        whishi = np.fmax(high, q3)
+        outside = ~inside & ~np.isnan(values)
+
+        return [{'label': str(col), 'q1': q1[i], 'med': med[i], 'q3': q3[i], 'whislo': whislo[i], 'whishi': whishi[i], 'fliers': values[outside[:, i], i]}
+                for i, col in enumerate(data.columns)]
+
+    def batched_box_plots(city:str, layout:str='grid', fig=None):
+        """
+        Public class method that plots the hourly box plots of all months from precomputed box plot statistics and saves the plots to visualizations folder.
+        The 'grid' layout draws the 12 months as small multiples in one figure, the 'single' layout redraws one figure for every month.
+        The figure is not registered with pyplot, so its memory is released as soon as the method returns.
 
         Parameters
         ----------
         city : str
             The city name.
-        data : pd.DataFrame
-            The data in a pandas DataFrame.
-        agg : int
-            The aggregation level of the data. Default is 1. Can be 1 , 4 or 5.
+        layout : str
+            The layout of the plots. Default is 'grid'. Can be 'grid' or 'single'.
+        fig : matplotlib.figure.Figure
+            A figure to draw into, so that the same figure can be reused across cities. It is cleared before drawing. Default is None.
 
         Returns
         -------
         None
         """
-        import matplotlib.pyplot as plt
+        import itertools
+        from matplotlib import colormaps
+        from matplotlib.figure import Figure
+
+        logging.info(f"Plotting batched hourly box plots ({layout}) for {city}.")
+
+        sheets = pd.read_excel(f'transformed_data/{city}/monthly_hourly_means.xlsx', sheet_name=None, index_col=0)
+        stats = {sheet: EDA.box_plot_stats(data) for sheet, data in sheets.items()}
+
+        def draw(ax, box_stats):
+            boxes = ax.bxp(box_stats, patch_artist=True)
+            for patch, color in zip(boxes['boxes'], itertools.cycle(colormaps['Set3'].colors)):
+                patch.set_facecolor(color)
+
+        if layout == 'grid':
+            fig = fig if fig is not None else Figure()
+            fig.clf()
+            fig.set_size_inches(28, 18)
+            axes = fig.subplots(3, 4, sharey=True)
+            for ax, (sheet, box_stats) in zip(axes.flat, stats.items()):
+                draw(ax, box_stats)
+                ax.set_title(sheet, fontsize=14, fontweight='bold')
+                ax.tick_params(axis='x', labelrotation=90, labelsize=8)
+            fig.suptitle(f'Hourly Box Plots for {city}', fontsize=16, fontweight='bold')
+            fig.supxlabel('Hour', fontsize=14)
+            fig.supylabel('Electricity (in kW)', fontsize=14)
+            fig.tight_layout()
+            fig.savefig(f'visualizations/{city}/box_plots/monthly_box_plots.png')
+
+        elif layout == 'single':
+            fig = fig if fig is not None else Figure()
+            fig.clf()
+            fig.set_size_inches(14, 8)
+            ax = fig.subplots()
+            for sheet, box_stats in stats.items():
+                ax.clear()
+                draw(ax, box_stats)
+                ax.set_title(f'Hourly Box Plots for {sheet}', fontsize=16, fontweight='bold')
+                ax.set_xlabel('Hour', fontsize=14)
+                ax.set_ylabel('Electricity (in kW)', fontsize=14)
+                ax.tick_params(axis='x', labelrotation=45)
+                fig.tight_layout()
+                fig.savefig(f'visualizations/{city}/box_plots/{sheet}_box_plot.png')
 
-        logging.info(f"Plotting yearly plots for {city} with {agg} yearly aggregation.")
+        else:
+            logging.error(f"Layout {layout} is not supported.")
+            raise ValueError
+
+        fig.clf()
 
-        data = data.copy()
+        logging.info(f"Batched hourly box plots ({layout}) for {city} plotted and saved to visualizations/box_plots.")
 
-        data['local_time'] = data['local_time'].dt.year
-        data = data.groupby('local_time').sum()
-        #data.reset_index(inplace=True)
-        data = data.iloc[:-1,:]
+    def batched_daily_mean_plots(city:str, layout:str='grid', fig=None):
+        """
+        Public class method that plots the daily mean plots of all months and saves the plots to visualizations folder.
+        The 'grid' layout draws the 12 months as small multiples in one figure, the 'single' layout redraws one figure for every month.
+        The figure is not registered with pyplot, so its memory is released as soon as the method returns.
 
-        if agg == 1:
-            data = data
+        Parameters
+        ----------
+        city : str
+            The city name.
+        layout : str
+            The layout of the plots. Default is 'grid'. Can be 'grid' or 'single'.
+        fig : matplotlib.figure.Figure
+            A figure to draw into, so that the same figure can be reused across cities. It is cleared before drawing. Default is None.
+
+        Returns
+        -------
+        None
+        """
+        from matplotlib.figure import Figure
 
-        elif agg == 4:
-            data_4Y = {}
+        logging.info(f"Plotting batched daily mean plots ({layout}) for {city}.")
 
-            for i in range(1980, 2024, 4):
-                data_4Y[f'{i}-{i+3}'] = data.loc[i:i+3, 'electricity'].mean()
-            data_4Y = pd.Series(data_4Y)
-            data = data_4Y
+        monthly_means = pd.read_excel(f'transformed_data/{city}/monthly_daily_means.xlsx', index_col=0)
 
-        elif agg == 5:
-            data_5Y = {}
+        month_to_name = {1: 'January', 2: 'February', 3: 'March', 4: 'April', 5: 'May', 6: 'June', 7: 'July', 8: 'August', 9: 'September', 10: 'October', 11: 'November', 12: 'December'}
 
-            for i in range(1984, 2024, 5):
-                data_5Y[f'{i}-{i+4}'] = data.loc[i:i+4, 'electricity'].mean()
-            data_5Y = pd.Series(data_5Y)
-            data = data_5Y
+        def draw(ax, month):
+            ax.plot(monthly_means[month], color='blue', linestyle='-', linewidth=2, marker='o', markersize=6)
+            ax.grid(True, linestyle='--', alpha=0.6)
+            ax.set_ylim(0, 10000)
+
+        if layout == 'grid':
+            fig = fig if fig is not None else Figure()
+            fig.clf()
+            fig.set_size_inches(24, 14)
+            axes = fig.subplots(3, 4, sharex=True, sharey=True)
+            for ax, month in zip(axes.flat, range(1, 13)):
+                draw(ax, month)
+                ax.set_title(month_to_name[month], fontsize=14, fontweight='bold')
+            fig.suptitle(f'Average Daily Electricity Production in {city}', fontsize=16, fontweight='bold')
+            fig.supxlabel('Year', fontsize=14, fontweight='bold')
+            fig.supylabel('Electricity (kWh)', fontsize=14, fontweight='bold')
+            fig.tight_layout()
+            fig.savefig(f'visualizations/{city}/daily_mean_plots/monthly_daily_means.png')
+
+        elif layout == 'single':
+            fig = fig if fig is not None else Figure()
+            fig.clf()
+            fig.set_size_inches(10, 6)
+            ax = fig.subplots()
+            for month in range(1, 13):
+                ax.clear()
+                draw(ax, month)
+                ax.set_xlabel('Year', fontsize=14, fontweight='bold')
+                ax.set_ylabel('Electricity (kWh)', fontsize=14, fontweight='bold')
+                ax.set_title(f'Average Daily Electricity Production in {city} [{month_to_name[month]}]', fontsize=16, fontweight='bold')
+                fig.savefig(f'visualizations/{city}/daily_mean_plots/{month}.png')
 
         else:
+            logging.error(f"Layout {layout} is not supported.")
+            raise ValueError
+
+        fig.clf()
+
+        logging.info(f"Batched daily mean plots ({layout}) for {city} plotted and saved to visualizations folder.")
+
+    def yearly_totals(data) -> pd.Series:
+        """
+        Public class method that returns the yearly totals of the data.
+
+        Parameters
+        ----------
+        data : pd.DataFrame or Cube
+            The data in a pandas DataFrame, or its cube.
+
+        Returns
+        -------
+        pd.Series
+            The yearly totals, indexed by year.
+        """
+        cube = Cube.of(data)
+        return pd.Series(cube.stats(('year',))[1], index=cube.years, name='electricity')
+
+    def block_means(totals:pd.Series, length:int, align:int=None, partial:str='keep') -> pd.Series:
+        """
+        Public class method that averages the yearly totals over blocks of years in one vectorized pass.
+
+        Parameters
+        ----------
+        totals : pd.Series
+            The yearly totals, indexed by year.
+        length : int
+            The number of years in a block.
+        align : int
+            A year that starts a block. Default is None, the first year.
+        partial : str
+            What to do with incomplete blocks. Default is 'keep'. Can be 'keep', 'drop' or 'merge', see utils.year_blocks.
+
+        Returns
+        -------
+        pd.Series
+            The mean yearly total of every block, indexed by the block label.
+        """
+        codes, labels = year_blocks(totals.index, length, align, partial)
+
+        return pd.Series(kernel_utils.group_mean(codes, totals.to_numpy(), len(labels)), index=labels, name=totals.name)
+
+    def yearly_plots(city:str, data, agg:int = 1, align:int=None, partial:str='keep'):
+        """
+        Public class method that plots the yearly electricity production, averaged over blocks of years, and saves the plot to visualizations folder.
+
+        Parameters
+        ----------
+        city : str
+            The city name.
+        data : pd.DataFrame or Cube
+            The data in a pandas DataFrame, or its cube.
+        agg : int
+            The number of years in a block. Default is 1, no aggregation.
+        align : int
+            A year that starts a block. Default is None, the first year.
+        partial : str
+            What to do with incomplete blocks. Default is 'keep'. Can be 'keep', 'drop' or 'merge', see utils.year_blocks.
+
+        Returns
+        -------
+        None
+        """
+        import matplotlib.pyplot as plt
+
+        logging.info(f"Plotting yearly plots for {city} with {agg} yearly aggregation.")
+
+        if agg < 1:
             logging.error(f"Aggregation level {agg} is not supported.")
             raise ValueError
 
+        data = EDA.yearly_totals(data)
+
+        if agg > 1:
+            data = EDA.block_means(data, agg, align, partial)
+
         # Create the plot with a larger figure size
         plt.figure(figsize=(20,10))
 
@@ -297,4 +499,60 @@ class EDA():
         plt.savefig(f'visualizations/{city}/{agg}_yearly_plot.png')
         plt.close()
 
-        logging.info(f"Yearly plot with {agg} yearly aggregation for {city} plotted and saved to visualizations folder.")
\ No newline at end of file
+        logging.info(f"Yearly plot with {agg} yearly aggregation for {city} plotted and saved to visualizations folder.")
+
+    def yearly_block_sweep(city:str, data, lengths:tuple=(1, 4, 5), align:int=None, partial:str='keep', fig=None) -> pd.DataFrame:
+        """
+        Public class method that averages the yearly totals over blocks of every given length, from one yearly totals array,
+        and plots all of them in one figure saved to visualizations folder. Meant for sensitivity studies over the block length.
+
+        Parameters
+        ----------
+        city : str
+            The city name.
+        data : pd.DataFrame or Cube
+            The data in a pandas DataFrame, or its cube.
+        lengths : tuple
+            The block lengths in years. Default is (1, 4, 5).
+        align : int
+            A year that starts a block. Default is None, the first year.
+        partial : str
+            What to do with incomplete blocks. Default is 'keep'. Can be 'keep', 'drop' or 'merge', see utils.year_blocks.
+        fig : matplotlib.figure.Figure
+            A figure to draw into, so that the same figure can be reused across cities. It is cleared before drawing. Default is None.
+
+        Returns
+        -------
+        pd.DataFrame
+            The block means of every block length, with columns length, block, first year and mean.
+        """
+        from matplotlib.figure import Figure
+
+        logging.info(f"Sweeping yearly block lengths {lengths} for {city}.")
+
+        totals = EDA.yearly_totals(data)
+
+        sweep = {length: EDA.block_means(totals, length, align, partial) for length in lengths}
+
+        fig = fig if fig is not None else Figure()
+        fig.clf()
+        fig.set_size_inches(20, 5 * len(lengths))
+        axes = fig.subplots(len(lengths), 1, squeeze=False)[:, 0]
+
+        for ax, (length, means) in zip(axes, sweep.items()):
+            ax.plot(means.index, means.to_numpy(), color='blue', linestyle='-', linewidth=2, marker='o', markersize=6)
+            ax.grid(True, linestyle='--', alpha=0.6)
+            ax.set_title(f'{length} - Yearly Electricity Production in {city}', fontsize=14, fontweight='bold')
+            ax.set_ylim(0, 2500000)
+            ax.tick_params(axis='x', labelrotation=45 if length > 1 else 90)
+
+        fig.supxlabel('Year', fontsize=14, fontweight='bold')
+        fig.supylabel('Electricity ($10^6$ kWh)', fontsize=14, fontweight='bold')
+        fig.tight_layout()
+        fig.savefig(f'visualizations/{city}/yearly_block_sweep.png')
+        fig.clf()
+
+        logging.info(f"Yearly block sweep for {city} plotted and saved to visualizations folder.")
+
+        return pd.concat([pd.DataFrame({'length': length, 'block': means.index, 'first_year': [int(label[:4]) for label in means.index], 'mean': means.to_numpy()})
+                          for length, means in sweep.items()], ignore_index=True)
@@ -0,0 +1,507 @@
+import logging
+import numpy as np
+
+# Grouped statistics over integer group codes, shared by all the analyses.
+# Every function takes the group code of every value and the number of groups: codes outside [0, n_groups) and NaN values are left out.
+# The NumPy backend is always available, the Numba backend compiles loop kernels on first use when numba is installed.
+# The precision sets the float type the hourly grid and the cubes are stored and reduced in, float64 unless float32 is opted in.
+
+BACKENDS = ('numpy', 'numba')
+
+backend = 'numpy'
+
+def set_backend(name:str):
+    """
+    This function selects the backend of the grouped statistics kernels, and checks that it matches pandas (see check_against_pandas).
+
+    Parameters
+    ----------
+    name : str
+        The backend. Can be 'numpy' or 'numba'.
+
+    Returns
+    -------
+    None
+    """
+    global backend
+
+    if name not in BACKENDS:
+        logging.error(f"Backend {name} is not supported.")
+        raise ValueError
+
+    if name == 'numba':
+        numba_kernels()
+
+    previous, backend = backend, name
+    try:
+        check_against_pandas()
+    except ValueError:
+        backend = previous
+        raise
+
+    logging.info(f"Grouped statistics kernels use the {name} backend.")
+
+def get_backend() -> str:
+    """
+    This function returns the selected backend of the grouped statistics kernels.
+
+    Returns
+    -------
+    str
+        The backend.
+    """
+    return backend
+
+PRECISIONS = ('float64', 'float32')
+
+precision = 'float64'
+
+def set_precision(name:str):
+    """
+    This function selects the float type the hourly grid and the cubes are stored and reduced in.
+    In float32 the sums are computed pairwise (see reduce_sum), and the ANOVA formulas always run in float64.
+
+    Parameters
+    ----------
+    name : str
+        The precision. Can be 'float64' or 'float32'.
+
+    Returns
+    -------
+    None
+    """
+    global precision
+
+    if name not in PRECISIONS:
+        logging.error(f"Precision {name} is not supported.")
+        raise ValueError
+
+    precision = name
+    logging.info(f"Grids and cubes are stored in {name}.")
+
+def get_precision() -> str:
+    """
+    This function returns the selected precision.
+
+    Returns
+    -------
+    str
+        The precision.
+    """
+    return precision
+
+def float_type() -> type:
+    """
+    This function returns the numpy float type of the selected precision.
+
+    Returns
+    -------
+    type
+        np.float64 or np.float32.
+    """
+    return np.float32 if precision == 'float32' else np.float64
+
+def reduce_sum(array:np.ndarray, axis) -> np.ndarray:
+    """
+    This function sums an array over the given axes. Float32 arrays are summed pairwise: the summed axes are moved last
+    and made contiguous, so that numpy's pairwise summation applies and the error grows with the logarithm of the number
+    of values instead of linearly, as it would when numpy accumulates along a strided axis.
+
+    Parameters
+    ----------
+    array : np.ndarray
+        The array.
+    axis : int or tuple
+        The axes to sum over.
+
+    Returns
+    -------
+    np.ndarray
+        The sums, with the dtype of the array.
+    """
+    if array.dtype != np.float32:
+        return array.sum(axis=axis)
+
+    axes = tuple(a % array.ndim for a in np.atleast_1d(axis))
+    kept = [a for a in range(array.ndim) if a not in axes]
+    moved = np.ascontiguousarray(np.transpose(array, kept + list(axes)))
+    return moved.reshape(moved.shape[:len(kept)] + (-1,)).sum(axis=-1)
+
+_numba_kernels = {}
+
+def numba_kernels() -> dict:
+    """
+    This function compiles the Numba kernels on first use.
+
+    Returns
+    -------
+    dict
+        The compiled kernels by name.
+    """
+    if _numba_kernels:
+        return _numba_kernels
+
+    try:
+        import numba
+    except ImportError:
+        logging.error("The numba backend needs numba to be installed.")
+        raise
+
+    @numba.njit(cache=True)
+    def stats(codes, values, n_groups):
+        count = np.zeros(n_groups)
+        total = np.zeros(n_groups)
+        sumsq = np.zeros(n_groups)
+        for i in range(codes.shape[0]):
+            code = codes[i]
+            value = values[i]
+            if code >= 0 and code < n_groups and not np.isnan(value):
+                count[code] += 1.0
+                total[code] += value
+                sumsq[code] += value * value
+        return count, total, sumsq
+
+    @numba.njit(cache=True)
+    def minmax(codes, values, n_groups):
+        low = np.full(n_groups, np.inf)
+        high = np.full(n_groups, -np.inf)
+        for i in range(codes.shape[0]):
+            code = codes[i]
+            value = values[i]
+            if code >= 0 and code < n_groups and not np.isnan(value):
+                if value < low[code]:
+                    low[code] = value
+                if value > high[code]:
+                    high[code] = value
+        return low, high
+
+    _numba_kernels['stats'] = stats
+    _numba_kernels['minmax'] = minmax
+    return _numba_kernels
+
+def _valid(codes, values, n_groups:int) -> tuple:
+    """
+    This function returns the codes and values as flat arrays, without the values that are left out.
+    """
+    codes = np.asarray(codes, dtype=np.int64).ravel()
+    values = np.asarray(values, dtype=float).ravel()
+    keep = (codes >= 0) & (codes < n_groups) & ~np.isnan(values)
+    return codes[keep], values[keep]
+
+def group_stats(codes, values, n_groups:int) -> tuple:
+    """
+    This function returns the count, sum and sum of squares of the values of every group, in one pass over the values.
+
+    Parameters
+    ----------
+    codes : array-like
+        The group code of every value.
+    values : array-like
+        The values.
+    n_groups : int
+        The number of groups.
+
+    Returns
+    -------
+    tuple
+        The count, sum and sum of squares of every group.
+    """
+    if backend == 'numba':
+        return numba_kernels()['stats'](np.asarray(codes, dtype=np.int64).ravel(), np.asarray(values, dtype=float).ravel(), n_groups)
+
+    codes, values = _valid(codes, values, n_groups)
+    count = np.bincount(codes, minlength=n_groups).astype(float)
+    total = np.bincount(codes, weights=values, minlength=n_groups)
+    sumsq = np.bincount(codes, weights=values * values, minlength=n_groups)
+    return count, total, sumsq
+
+def group_count(codes, values, n_groups:int) -> np.ndarray:
+    """
+    This function returns the number of values of every group.
+
+    Parameters
+    ----------
+    codes : array-like
+        The group code of every value.
+    values : array-like
+        The values.
+    n_groups : int
+        The number of groups.
+
+    Returns
+    -------
+    np.ndarray
+        The count of every group.
+    """
+    return group_stats(codes, values, n_groups)[0]
+
+def group_sum(codes, values, n_groups:int) -> np.ndarray:
+    """
+    This function returns the sum of the values of every group, 0 for empty groups.
+
+    Parameters
+    ----------
+    codes : array-like
+        The group code of every value.
+    values : array-like
+        The values.
+    n_groups : int
+        The number of groups.
+
+    Returns
+    -------
+    np.ndarray
+        The sum of every group.
+    """
+    return group_stats(codes, values, n_groups)[1]
+
+def group_sumsq(codes, values, n_groups:int) -> np.ndarray:
+    """
+    This function returns the sum of the squared values of every group, 0 for empty groups.
+
+    Parameters
+    ----------
+    codes : array-like
+        The group code of every value.
+    values : array-like
+        The values.
+    n_groups : int
+        The number of groups.
+
+    Returns
+    -------
+    np.ndarray
+        The sum of squares of every group.
+    """
+    return group_stats(codes, values, n_groups)[2]
+
+def group_mean(codes, values, n_groups:int) -> np.ndarray:
+    """
+    This function returns the mean of the values of every group, NaN for empty groups.
+
+    Parameters
+    ----------
+    codes : array-like
+        The group code of every value.
+    values : array-like
+        The values.
+    n_groups : int
+        The number of groups.
+
+    Returns
+    -------
+    np.ndarray
+        The mean of every group.
+    """
+    count, total, _ = group_stats(codes, values, n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+def group_var(codes, values, n_groups:int, ddof:int=1) -> np.ndarray:
+    """
+    This function returns the variance of the values of every group, NaN for groups with ddof values or fewer.
+    The values are centered on their group mean first, so that large values do not lose precision.
+
+    Parameters
+    ----------
+    codes : array-like
+        The group code of every value.
+    values : array-like
+        The values.
+    n_groups : int
+        The number of groups.
+    ddof : int
+        The delta degrees of freedom. Default is 1, the sample variance like pandas.
+
+    Returns
+    -------
+    np.ndarray
+        The variance of every group.
+    """
+    codes, values = _valid(codes, values, n_groups)
+    count, total, _ = group_stats(codes, values, n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        _, _, squares = group_stats(codes, values - mean[codes], n_groups)
+        return np.where(count > ddof, squares / (count - ddof), np.nan)
+
+def group_min(codes, values, n_groups:int) -> np.ndarray:
+    """
+    This function returns the minimum of the values of every group, NaN for empty groups.
+
+    Parameters
+    ----------
+    codes : array-like
+        The group code of every value.
+    values : array-like
+        The values.
+    n_groups : int
+        The number of groups.
+
+    Returns
+    -------
+    np.ndarray
+        The minimum of every group.
+    """
+    return group_minmax(codes, values, n_groups)[0]
+
+def group_max(codes, values, n_groups:int) -> np.ndarray:
+    """
+    This function returns the maximum of the values of every group, NaN for empty groups.
+
+    Parameters
+    ----------
+    codes : array-like
+        The group code of every value.
+    values : array-like
+        The values.
+    n_groups : int
+        The number of groups.
+
+    Returns
+    -------
+    np.ndarray
+        The maximum of every group.
+    """
+    return group_minmax(codes, values, n_groups)[1]
+
+def group_minmax(codes, values, n_groups:int) -> tuple:
+    """
+    This function returns the minimum and the maximum of the values of every group, in one pass over the values.
+
+    Parameters
+    ----------
+    codes : array-like
+        The group code of every value.
+    values : array-like
+        The values.
+    n_groups : int
+        The number of groups.
+
+    Returns
+    -------
+    tuple
+        The minimum and maximum of every group, NaN for empty groups.
+    """
+    if backend == 'numba':
+        low, high = numba_kernels()['minmax'](np.asarray(codes, dtype=np.int64).ravel(), np.asarray(values, dtype=float).ravel(), n_groups)
+    else:
+        codes, values = _valid(codes, values, n_groups)
+        low = np.full(n_groups, np.inf)
+        high = np.full(n_groups, -np.inf)
+        np.minimum.at(low, codes, values)
+        np.maximum.at(high, codes, values)
+
+    empty = np.isinf(low) & np.isinf(high) & (low > high)
+    low[empty] = np.nan
+    high[empty] = np.nan
+    return low, high
+
+def group_quantile(codes, values, n_groups:int, q) -> np.ndarray:
+    """
+    This function returns quantiles of the values of every group, with linear interpolation like numpy.percentile and pandas.
+    There is one NumPy implementation for both backends: it sorts the values by group once and interpolates all the quantiles
+    of all the groups in one vectorized step.
+
+    Parameters
+    ----------
+    codes : array-like
+        The group code of every value.
+    values : array-like
+        The values.
+    n_groups : int
+        The number of groups.
+    q : float or array-like
+        The quantiles, between 0 and 1.
+
+    Returns
+    -------
+    np.ndarray
+        The quantiles, with shape (len(q), n_groups), or (n_groups,) for a single quantile. NaN for empty groups.
+    """
+    codes, values = _valid(codes, values, n_groups)
+    order = np.lexsort((values, codes))
+    values = values[order]
+
+    count = np.bincount(codes, minlength=n_groups)
+    start = np.cumsum(count) - count
+
+    quantiles = np.atleast_1d(np.asarray(q, dtype=float))[:, None]
+    position = quantiles * np.maximum(count - 1, 0)
+    low = np.floor(position).astype(np.int64)
+    high = np.minimum(low + 1, np.maximum(count - 1, 0))
+    fraction = position - low
+
+    # empty groups point at a valid index and are masked afterwards
+    last = max(len(values) - 1, 0)
+    lower = values[np.minimum(start + low, last)] if len(values) else np.zeros(low.shape)
+    upper = values[np.minimum(start + high, last)] if len(values) else np.zeros(high.shape)
+    result = np.where(count > 0, lower + (upper - lower) * fraction, np.nan)
+
+    return result if np.ndim(q) else result[0]
+
+def check_against_pandas(n_values:int=10000, n_groups:int=50, seed:int=0) -> dict:
+    """
+    This function checks that the kernels of the selected backend give the same results as pandas' groupby on random data
+    with NaN values, empty groups and out of range codes, and raises a ValueError if they do not.
+
+    Parameters
+    ----------
+    n_values : int
+        The number of random values. Default is 10000.
+    n_groups : int
+        The number of groups. Default is 50.
+    seed : int
+        The random seed. Default is 0.
+
+    Returns
+    -------
+    dict
+        The largest absolute difference with pandas of every statistic.
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    # the last group is left empty
+    codes = rng.integers(0, n_groups - 1, n_values)
+    values = rng.normal(100.0, 20.0, n_values)
+    values[rng.random(n_values) < 0.05] = np.nan
+    # codes outside [0, n_groups) are left out
+    codes[rng.random(n_values) < 0.01] = -1
+    codes[rng.random(n_values) < 0.01] = n_groups
+
+    inside = (codes >= 0) & (codes < n_groups)
+    grouped = pd.Series(values[inside]).groupby(codes[inside])
+    index = np.arange(n_groups)
+
+    expected = {
+        'count': grouped.count().reindex(index, fill_value=0).to_numpy(dtype=float),
+        'sum': grouped.sum().reindex(index, fill_value=0.0).to_numpy(),
+        'mean': grouped.mean().reindex(index).to_numpy(),
+        'var': grouped.var().reindex(index).to_numpy(),
+        'min': grouped.min().reindex(index).to_numpy(),
+        'max': grouped.max().reindex(index).to_numpy(),
+        'median': grouped.quantile(0.5).reindex(index).to_numpy(),
+        'q90': grouped.quantile(0.9).reindex(index).to_numpy(),
+    }
+    actual = {
+        'count': group_count(codes, values, n_groups),
+        'sum': group_sum(codes, values, n_groups),
+        'mean': group_mean(codes, values, n_groups),
+        'var': group_var(codes, values, n_groups),
+        'min': group_min(codes, values, n_groups),
+        'max': group_max(codes, values, n_groups),
+        'median': group_quantile(codes, values, n_groups, 0.5),
+        'q90': group_quantile(codes, values, n_groups, 0.9),
+    }
+
+    differences = {}
+    for name in expected:
+        if expected[name].shape != actual[name].shape or not np.array_equal(np.isnan(expected[name]), np.isnan(actual[name])) \
+                or not np.allclose(expected[name], actual[name], rtol=1e-9, atol=1e-9, equal_nan=True):
+            logging.error(f"Grouped {name} of the {backend} backend differs from pandas.")
+            raise ValueError
+        differences[name] = float(np.nanmax(np.abs(expected[name] - actual[name])))
+
+    logging.info(f"Grouped statistics kernels ({backend}) match pandas.")
+    return differences
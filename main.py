@@ -1,52 +1,22 @@
-import pandas as pd
-import numpy as np
-import os
+import argparse
 import logging
 
-from utils import *
-from eda_utils import *
-from anova_utils import *
-from ttest_utils import *
+from pipeline_utils import *
 
 # print logging messages to the console
 logging.basicConfig(level=logging.INFO)
 
 def main():
-    city = 'Tokyo'
+    parser = argparse.ArgumentParser(description="Run the solar data analysis for the sites and stages of a run manifest.")
+    parser.add_argument('manifest', nargs='?', default='manifest.toml', help="The run manifest (TOML or YAML). Default is manifest.toml.")
+    parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and run every stage again.")
+    args = parser.parse_args()
 
-    File_Map(city)
+    status = Scheduler(Manifest.load(args.manifest)).run(restart=args.restart)
 
-    data = CSVInputFetcher.fetch_aggregated_data(CSVInputFetcher.city_filename_prefix(city), [1980, 2023])
-
-    data.drop(columns=['time'], inplace=True)
-    data['local_time'] = pd.to_datetime(data['local_time'])
-
-    logging.info(f"Performing EDA for {city}")
-
-    EDA.calculate_monthly_means(city, data, 'hourly')
-    EDA.hourly_control_charts(city)
-    EDA.hourly_box_plots(city)
-
-    EDA.calculate_monthly_means(city, data, 'daily')
-    EDA.daily_mean_plots(city)
-
-    EDA.yearly_plots(city, data, 1)
-    EDA.yearly_plots(city, data, 4)
-    EDA.yearly_plots(city, data, 5)
-
-    logging.info(f"Performing ANOVA tests for {city}")
-    ANOVA.normal_anova(city, data, 'hourly')
-    ANOVA.fourYblocks_anova(city, data, 'hourly')
-    ANOVA.elevenYblocks_anova(city, data, 'hourly')
-
-    ANOVA.normal_anova(city, data, 'daily')
-    ANOVA.fourYblocks_anova(city, data, 'daily')
-    ANOVA.elevenYblocks_anova(city, data, 'daily')
-
-    logging.info(f"Performing t-tests for {city}")
-    TTest(city).ttest_results(data, 4)
-    TTest(city).ttest_results(data, 11)
+    if any(state in ('failed', 'skipped') for state in status.values()):
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,503 @@
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+
+import kernel_utils
+from utils import CSVInputFetcher, File_Map
+from cube_utils import Cube
+from eda_utils import EDA
+from anova_utils import ANOVA
+from ttest_utils import TTest
+from report_utils import ReportWriter
+from results_utils import ResultsStore
+from precision_utils import check_precision
+
+def cube_path(site:str) -> str:
+    """
+    This function returns the path of the saved cube of a site.
+
+    Parameters
+    ----------
+    site : str
+        The site name.
+
+    Returns
+    -------
+    str
+        The path of the cube file.
+    """
+    return f'transformed_data/{site}/cube.npz'
+
+def build_cube(site:dict, col:str='electricity', fill:str='none', duplicates:str='mean', misaligned:str='error'):
+    """
+    Stage that fetches and validates the data of a site, builds its cube and saves it, so that the other stages of the site can load it.
+
+    Parameters
+    ----------
+    site : dict
+        The site, with its name, filename prefix and year range.
+    col : str
+        The column to aggregate. Default is 'electricity'.
+    fill : str
+        The fill policy for missing hours, see utils.validate_hourly. Default is 'none'.
+    duplicates : str
+        The policy for duplicated hours, see utils.validate_hourly. Default is 'mean'.
+    misaligned : str
+        The policy for times that are not on the hour, see utils.validate_hourly. Default is 'error'.
+
+    Returns
+    -------
+    None
+    """
+    File_Map(site['name'])
+
+    data = CSVInputFetcher.fetch_validated_data(site['prefix'], site['years'], col, fill, duplicates, misaligned)
+
+    Cube.from_data(data, col, site['years']).save(cube_path(site['name']))
+
+def site_cubes(site:dict) -> dict:
+    """
+    This function loads the saved cubes of a site, or of all the sites of a cross-site task.
+
+    Parameters
+    ----------
+    site : dict
+        The site, or the cross-site pseudo site with the names of all the sites in 'sites'.
+
+    Returns
+    -------
+    dict
+        The cube of every site, by site name.
+    """
+    return {name: Cube.load(cube_path(name)) for name in site.get('sites', [site['name']])}
+
+def precision_stage(site:dict, col:str='electricity', fill:str='none', duplicates:str='mean', misaligned:str='error', tolerances:dict=None, writer:ReportWriter=None, store=None):
+    """
+    Stage that checks the float32 results of a site against float64, see precision_utils.check_precision.
+    It only runs when float32 is selected, and validates the data with the same policies as the cube stage of the manifest.
+
+    Parameters
+    ----------
+    site : dict
+        The site, with its name, filename prefix and year range.
+    col : str
+        The column to aggregate. Default is 'electricity'.
+    fill : str
+        The fill policy for missing hours, see utils.validate_hourly. Default is 'none'.
+    duplicates : str
+        The policy for duplicated hours, see utils.validate_hourly. Default is 'mean'.
+    misaligned : str
+        The policy for times that are not on the hour, see utils.validate_hourly. Default is 'error'.
+    tolerances : dict
+        The tolerances of the check. Default is None, precision_utils.TOLERANCES.
+    writer : ReportWriter
+        The writer that writes the comparison workbook. Default is None, the workbook is written right away.
+    store : ResultsStore
+        Not used, report stages all take a results store.
+
+    Returns
+    -------
+    None
+    """
+    if kernel_utils.get_precision() != 'float32':
+        logging.info(f"Precision check for {site['name']} skipped, the results are computed in {kernel_utils.get_precision()}.")
+        return
+
+    data = CSVInputFetcher.fetch_validated_data(site['prefix'], site['years'], col, fill, duplicates, misaligned)
+
+    check_precision(site['name'], data, col, site['years'], tolerances=tolerances, writer=writer)
+
+# stages that can be listed in a manifest, they all take the site first and the stage parameters as keyword arguments
+STAGES = {
+    'cube': build_cube,
+    'monthly_means': lambda site, agg='hourly', writer=None, store=None: EDA.calculate_monthly_means(site['name'], Cube.load(cube_path(site['name'])), agg, writer, store),
+    'control_charts': lambda site: EDA.hourly_control_charts(site['name']),
+    'box_plots': lambda site, layout='single': EDA.batched_box_plots(site['name'], layout),
+    'daily_mean_plots': lambda site, layout='single': EDA.batched_daily_mean_plots(site['name'], layout),
+    'yearly_plots': lambda site, agg=1, align=None, partial='keep': EDA.yearly_plots(site['name'], Cube.load(cube_path(site['name'])), agg, align, partial),
+    'yearly_block_sweep': lambda site, lengths=(1, 4, 5), align=None, partial='keep': EDA.yearly_block_sweep(site['name'], Cube.load(cube_path(site['name'])), lengths, align, partial),
+    'anova': lambda site, agg='hourly', block=1, writer=None, store=None: ANOVA.block_anova(site['name'], Cube.load(cube_path(site['name'])), agg, block, writer, store),
+    'ttest': lambda site, agg=4, writer=None, store=None: TTest(site['name']).ttest_results(Cube.load(cube_path(site['name'])), agg, writer, store),
+    'two_way_anova': lambda site, agg='daily', factors=('year', 'month'), block=None, writer=None, store=None: ANOVA.two_way_anova(site_cubes(site), agg, tuple(factors), block, writer, store),
+    'precision_check': precision_stage,
+    'cross_site_anova': lambda site, agg='hourly', factor='year', block=None, writer=None, store=None: ANOVA.cross_site_anova(site_cubes(site), agg, factor, block, writer, store),
+}
+
+# stages that write workbooks, they also take a report writer and a results store
+REPORT_STAGES = {'monthly_means', 'anova', 'ttest', 'two_way_anova', 'cross_site_anova', 'precision_check'}
+
+def run_stage(run:str, site:dict, params:dict, backend:str='numpy', store:str=None, precision:str='float64') -> list:
+    """
+    This function runs one stage for one site. It is a module level function so that it can be sent to worker processes.
+    The workbooks of the stage are not written here but returned, so that the scheduler writes them on its background thread
+    while the workers go on with the next stages. The workbooks of a stage that fails are written before the error is raised.
+
+    Parameters
+    ----------
+    run : str
+        The name of the stage in STAGES.
+    site : dict
+        The site, with its name, filename prefix and year range.
+    params : dict
+        The parameters of the stage.
+    backend : str
+        The backend of the grouped statistics kernels, see kernel_utils. Default is 'numpy'.
+    store : str
+        The path of the results store the results of the stage are also written to. Default is None, no store.
+    precision : str
+        The precision the grids and cubes are stored and reduced in, see kernel_utils. Default is 'float64'.
+
+    Returns
+    -------
+    list
+        The workbooks of the stage, as (path, sheets) pairs for ReportWriter.submit.
+    """
+    if kernel_utils.get_backend() != backend:
+        kernel_utils.set_backend(backend)
+    if kernel_utils.get_precision() != precision:
+        kernel_utils.set_precision(precision)
+
+    if run not in REPORT_STAGES:
+        STAGES[run](site, **params)
+        return []
+
+    writer = ReportWriter(collect=True)
+    try:
+        if store is None:
+            STAGES[run](site, writer=writer, **params)
+        else:
+            with ResultsStore(store) as results:
+                STAGES[run](site, writer=writer, store=results, **params)
+        writer.flush()
+
+    except Exception:
+        writer.flush()
+        for path, workbook in writer.collected:
+            writer.write_workbook(path, workbook)
+        raise
+
+    return writer.collected
+
+
+class Manifest():
+    """
+    Class that holds a run manifest: the sites with their year ranges, and the stages to run for every site with their parameters.
+
+    A manifest is a TOML (or YAML) file like:
+
+        years = [1980, 2023]
+        workers = 4
+
+        [sites.Tokyo]
+        prefix = "1980-2023 renewable energy data/ninja_pv_35.2474_140.4001_"
+
+        [[stages]]
+        name = "hourly_means"
+        run = "monthly_means"
+        params = { agg = "hourly" }
+
+        [[stages]]
+        name = "box_plots"
+        after = ["hourly_means"]
+
+        [[stages]]
+        name = "cross_site_anova"
+        scope = "all"
+    """
+
+    def __init__(self, sites:dict, stages:list, years:tuple=(1980, 2023), workers:int=1, checkpoint:str='results/checkpoint.json', backend:str='numpy', store:str='results/results.sqlite', precision:str='float64'):
+        """
+        Constructor for the Manifest class.
+
+        Parameters
+        ----------
+        sites : dict
+            The sites by name, each with an optional 'prefix' of its csv files and an optional 'years' range.
+        stages : list
+            The stages, each with a 'name', an optional 'run' (the stage in STAGES, default is the name),
+            optional 'params', an optional 'after' list of stage names it depends on and an optional 'scope':
+            'site' (default, one task per site) or 'all' (one task for all the sites together).
+        years : tuple
+            The default year range of the sites. Default is (1980, 2023).
+        workers : int
+            The number of tasks run at the same time. Default is 1.
+        checkpoint : str
+            The path of the checkpoint file. Default is 'results/checkpoint.json'.
+        backend : str
+            The backend of the grouped statistics kernels, 'numpy' or 'numba'. Default is 'numpy'.
+        store : str
+            The path of the results store the ANOVA, t-test and means stages also write to. Default is 'results/results.sqlite', empty for no store.
+        precision : str
+            The precision the grids and cubes are stored and reduced in, 'float64' or 'float32'. Default is 'float64'.
+        """
+        self.sites = {}
+        for name, site in sites.items():
+            site = dict(site or {})
+            site['name'] = name
+            site.setdefault('prefix', None)
+            site['years'] = list(site.get('years', years))
+            if site['prefix'] is None:
+                site['prefix'] = CSVInputFetcher.city_filename_prefix(name)
+            self.sites[name] = site
+
+        self.stages = []
+        for stage in stages:
+            stage = dict(stage)
+            stage.setdefault('run', stage['name'])
+            stage.setdefault('params', {})
+            stage.setdefault('after', [])
+            stage.setdefault('scope', 'site')
+            if stage['run'] not in STAGES or stage['scope'] not in ('site', 'all'):
+                logging.error(f"Stage {stage['run']} is not supported.")
+                raise ValueError
+            self.stages.append(stage)
+
+        # the precision check validates the data with the same policies as the cube
+        cube_params = next((stage['params'] for stage in self.stages if stage['run'] == 'cube'), {})
+        for stage in self.stages:
+            if stage['run'] == 'precision_check':
+                stage['params'] = {**{name: cube_params[name] for name in ('col', 'fill', 'duplicates', 'misaligned') if name in cube_params}, **stage['params']}
+
+        names = [stage['name'] for stage in self.stages]
+        if len(set(names)) != len(names) or any(after not in names for stage in self.stages for after in stage['after']):
+            logging.error("Stage names must be unique and every dependency must be a stage of the manifest.")
+            raise ValueError
+
+        if backend not in kernel_utils.BACKENDS:
+            logging.error(f"Backend {backend} is not supported.")
+            raise ValueError
+
+        if precision not in kernel_utils.PRECISIONS:
+            logging.error(f"Precision {precision} is not supported.")
+            raise ValueError
+
+        self.workers = workers
+        self.checkpoint = checkpoint
+        self.backend = backend
+        self.store = store or None
+        self.precision = precision
+
+    def load(path:str) -> 'Manifest':
+        """
+        Public class method that loads a manifest from a TOML or YAML file.
+
+        Parameters
+        ----------
+        path : str
+            The path to the manifest file, ending in .toml, .yaml or .yml.
+
+        Returns
+        -------
+        Manifest
+            The loaded manifest.
+        """
+        logging.info(f"Loading manifest from {path}.")
+
+        if not os.path.exists(path):
+            logging.error(f"File {path} does not exist.")
+            raise FileNotFoundError
+
+        if path.endswith('.toml'):
+            import tomllib
+            with open(path, 'rb') as file:
+                config = tomllib.load(file)
+
+        elif path.endswith(('.yaml', '.yml')):
+            import yaml
+            with open(path) as file:
+                config = yaml.safe_load(file)
+
+        else:
+            logging.error(f"Manifest format of {path} is not supported.")
+            raise ValueError
+
+        return Manifest(**config)
+
+    def tasks(self) -> dict:
+        """
+        Public method that expands the manifest into the task graph: one task per site and stage,
+        and one task for all the sites together ('all/stage') for the stages with the 'all' scope.
+        Every stage of a site depends on the cube of the site, and on the stages it lists in 'after'.
+        A stage of all the sites depends on the cubes of every site, and on the stages it lists in 'after' for every site.
+
+        Returns
+        -------
+        dict
+            The tasks by id ('site/stage'), each with its site, stage, fingerprint and dependencies.
+        """
+        cube_stages = [stage['name'] for stage in self.stages if stage['run'] == 'cube']
+        scopes = {stage['name']: stage['scope'] for stage in self.stages}
+        every_site = {'name': 'all', 'sites': list(self.sites), 'years': sorted({year for site in self.sites.values() for year in site['years']})}
+
+        tasks = {}
+        for stage in self.stages:
+            after = list(stage['after']) + ([] if stage['run'] == 'cube' else cube_stages)
+            sites = [every_site] if stage['scope'] == 'all' else list(self.sites.values())
+
+            for site in sites:
+                names = site.get('sites', [site['name']])
+                # a task is only skipped on resume if it was completed with the same site, parameters and precision
+                fingerprint = hashlib.sha1(json.dumps([site, stage['run'], stage['params'], self.precision], sort_keys=True, default=str).encode()).hexdigest()
+                tasks[f"{site['name']}/{stage['name']}"] = {
+                    'site': site,
+                    'stage': stage,
+                    'fingerprint': fingerprint,
+                    'after': sorted({f"all/{name}" if scopes[name] == 'all' else f"{site_name}/{name}" for name in after for site_name in names}),
+                }
+
+        return tasks
+
+
+class Scheduler():
+    """
+    Class that runs the task graph of a manifest, with independent tasks running concurrently in worker processes.
+    The workbooks of the tasks are written by one writer on a background thread, while the workers compute the next tasks.
+    Completed tasks are recorded in a checkpoint file, so that a run that crashed or had failed tasks can be resumed without redoing work.
+    """
+
+    def __init__(self, manifest:Manifest):
+        """
+        Constructor for the Scheduler class.
+
+        Parameters
+        ----------
+        manifest : Manifest
+            The manifest to run.
+        """
+        self.manifest = manifest
+        self.tasks = manifest.tasks()
+
+    def load_checkpoint(self) -> dict:
+        """
+        Public method that loads the fingerprints of the completed tasks from the checkpoint file.
+
+        Returns
+        -------
+        dict
+            The fingerprint of every completed task, by task id.
+        """
+        if not os.path.exists(self.manifest.checkpoint):
+            return {}
+
+        with open(self.manifest.checkpoint) as file:
+            return json.load(file)
+
+    def save_checkpoint(self, completed:dict):
+        """
+        Public method that saves the fingerprints of the completed tasks to the checkpoint file.
+        The file is replaced in one step, so that a crash while writing cannot corrupt it.
+
+        Parameters
+        ----------
+        completed : dict
+            The fingerprint of every completed task, by task id.
+
+        Returns
+        -------
+        None
+        """
+        folder = os.path.dirname(self.manifest.checkpoint)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        with open(self.manifest.checkpoint + '.tmp', 'w') as file:
+            json.dump(completed, file, indent=2, sort_keys=True)
+        os.replace(self.manifest.checkpoint + '.tmp', self.manifest.checkpoint)
+
+    def run(self, restart:bool=False) -> dict:
+        """
+        Public method that runs all the tasks that are not completed yet, in dependency order.
+        A failed task does not stop the run: only the tasks that depend on it are skipped.
+
+        Parameters
+        ----------
+        restart : bool
+            Whether to ignore the checkpoint and run every task again. Default is False.
+
+        Returns
+        -------
+        dict
+            The status of every task: 'done', 'cached', 'failed' or 'skipped'.
+        """
+        # the selected kernels are checked against pandas once, before any task runs
+        kernel_utils.set_backend(self.manifest.backend)
+
+        completed = {} if restart else self.load_checkpoint()
+
+        status = {}
+        for task_id, task in self.tasks.items():
+            if completed.get(task_id) == task['fingerprint']:
+                status[task_id] = 'cached'
+
+        # a task is redone if one of its dependencies is redone
+        changed = True
+        while changed:
+            changed = False
+            for task_id, task in self.tasks.items():
+                if status.get(task_id) == 'cached' and any(status.get(after) != 'cached' for after in task['after']):
+                    del status[task_id]
+                    changed = True
+
+        logging.info(f"Running {len(self.tasks) - len(status)} tasks, {len(status)} already completed.")
+
+        # tasks computing in the worker processes, and workbooks being written on the writer's background thread
+        running = {}
+        writing = {}
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.manifest.workers) as pool, ReportWriter() as writer:
+            while len(status) < len(self.tasks):
+                for task_id, task in self.tasks.items():
+                    if task_id in status or task_id in running.values() or task_id in writing.values():
+                        continue
+
+                    if any(status.get(after) in ('failed', 'skipped') for after in task['after']):
+                        logging.warning(f"Task {task_id} skipped because a task it depends on failed.")
+                        status[task_id] = 'skipped'
+
+                    elif all(status.get(after) in ('done', 'cached') for after in task['after']):
+                        logging.info(f"Starting task {task_id}.")
+                        running[pool.submit(run_stage, task['stage']['run'], task['site'], task['stage']['params'], self.manifest.backend, self.manifest.store, self.manifest.precision)] = task_id
+
+                if not running and not writing:
+                    # nothing is running and nothing could start, what is left depends on itself
+                    for task_id in self.tasks:
+                        if task_id not in status:
+                            logging.error(f"Task {task_id} skipped because its dependencies form a cycle.")
+                            status[task_id] = 'skipped'
+                    break
+
+                finished, _ = concurrent.futures.wait(list(running) + list(writing), return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    if future in running:
+                        task_id = running.pop(future)
+                        try:
+                            workbooks = future.result()
+                        except Exception:
+                            logging.exception(f"Task {task_id} failed.")
+                            status[task_id] = 'failed'
+                            continue
+
+                        for path, workbook in workbooks:
+                            writing[writer.submit(path, workbook)] = task_id
+
+                    else:
+                        task_id = writing.pop(future)
+                        try:
+                            future.result()
+                        except Exception:
+                            logging.exception(f"Writing the workbooks of task {task_id} failed.")
+                            status[task_id] = 'failed'
+
+                    # a task is done once its workbooks are written, so that the tasks that depend on it can read them
+                    if task_id not in status and task_id not in writing.values():
+                        status[task_id] = 'done'
+                        completed[task_id] = self.tasks[task_id]['fingerprint']
+                        self.save_checkpoint(completed)
+                        logging.info(f"Task {task_id} done.")
+
+        failed = [task_id for task_id, state in status.items() if state == 'failed']
+        logging.info(f"Run finished with {len(failed)} failed tasks" + (f": {', '.join(failed)}." if failed else "."))
+
+        return status
@@ -0,0 +1,134 @@
+import logging
+import numpy as np
+import pandas as pd
+
+import kernel_utils
+from cube_utils import Cube
+from anova_utils import ANOVA
+from report_utils import ReportWriter
+
+# How far the float32 results may be from the float64 baseline: |float32 - float64| <= atol + rtol * |float64|.
+# Means are sums of at most a few hundred thousand values divided by their count, pairwise summation keeps them to about 1e-6.
+# F-values are ratios of differences of sums, and the p-values follow from them.
+TOLERANCES = {
+    'mean': {'rtol': 1e-5, 'atol': 1e-6},
+    'F': {'rtol': 1e-3, 'atol': 1e-6},
+    'p': {'rtol': 0.0, 'atol': 1e-3},
+}
+
+def result_tables(cube:Cube, blocks:tuple=(1, 4, 11)) -> dict:
+    """
+    This function computes the tables the analysis reports from a cube: the monthly hourly and daily means,
+    and the F-values and p-values of the hourly and daily ANOVA for every block length.
+
+    Parameters
+    ----------
+    cube : Cube
+        The cube of the data.
+    blocks : tuple
+        The block lengths of the ANOVA, in years. Default is (1, 4, 11).
+
+    Returns
+    -------
+    dict
+        The tables as float64 arrays, keyed by (table name, statistic).
+    """
+    tables = {
+        ('monthly_hourly_means', 'mean'): cube.mean(('year', 'month', 'hour')),
+        ('monthly_daily_means', 'mean'): cube.mean(('year', 'month'), 'daily'),
+    }
+
+    for block in blocks:
+        for agg, dims in (('hourly', ('block', 'month', 'hour')), ('daily', ('block', 'month'))):
+            f, p = ANOVA.oneway_from_stats(*cube.stats(dims, agg, block=block))
+            tables[(f'anova_{agg}_{block}Y', 'F')] = f
+            tables[(f'anova_{agg}_{block}Y', 'p')] = p
+
+    return {key: np.asarray(table, dtype=np.float64) for key, table in tables.items()}
+
+def check_precision(city:str, data:pd.DataFrame, col:str='electricity', year_range:list=None, blocks:tuple=(1, 4, 11),
+                    tolerances:dict=None, alpha:float=0.05, writer:ReportWriter=None) -> pd.DataFrame:
+    """
+    This function checks that the float32 mode gives the same F, p and mean tables as float64 on the data of a site,
+    within the tolerances, and that no ANOVA changes its conclusion at the significance level.
+    The comparison is saved to results folder, and a ValueError is raised if the float32 results are off.
+
+    Parameters
+    ----------
+    city : str
+        The city name.
+    data : pd.DataFrame
+        The data in a pandas DataFrame, in full precision.
+    col : str
+        The column to aggregate. Default is 'electricity'.
+    year_range : list
+        The first and last year of the cubes. Default is None, all the years of the data.
+    blocks : tuple
+        The block lengths of the ANOVA, in years. Default is (1, 4, 11).
+    tolerances : dict
+        The rtol and atol of every statistic ('mean', 'F' and 'p'). Default is None, the module's TOLERANCES.
+    alpha : float
+        The significance level whose conclusions must not change. Default is 0.05.
+    writer : ReportWriter
+        The writer that writes the results workbook. Default is None, the workbook is written right away.
+
+    Returns
+    -------
+    pd.DataFrame
+        The largest absolute and relative differences of every table, and whether it passes.
+    """
+    logging.info(f"Checking float32 results against float64 for {city}.")
+
+    tolerances = {**TOLERANCES, **(tolerances or {})}
+    previous = kernel_utils.get_precision()
+
+    tables = {}
+    try:
+        for name in ('float64', 'float32'):
+            kernel_utils.set_precision(name)
+            tables[name] = result_tables(Cube.from_data(data, col, year_range), blocks)
+    finally:
+        kernel_utils.set_precision(previous)
+
+    rows = []
+    for (table, statistic), baseline in tables['float64'].items():
+        reduced = tables['float32'][(table, statistic)]
+        tolerance = tolerances[statistic]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            difference = np.abs(reduced - baseline)
+            relative = difference / np.abs(baseline)
+
+        # empty groups must stay empty, the rest must be within the tolerance
+        same_missing = np.array_equal(np.isnan(baseline), np.isnan(reduced))
+        within = np.allclose(reduced, baseline, rtol=tolerance['rtol'], atol=tolerance['atol'], equal_nan=True)
+
+        # a p-value on the other side of alpha only counts if it is not within the tolerance of alpha
+        flipped = 0
+        if statistic == 'p':
+            clear = np.abs(baseline - alpha) > tolerance['atol']
+            flipped = int(np.sum(clear & ((baseline < alpha) != (reduced < alpha))))
+
+        rows.append({
+            'table': table,
+            'statistic': statistic,
+            'max_abs_diff': float(np.nanmax(difference, initial=0.0)),
+            'max_rel_diff': float(np.nanmax(np.where(np.isinf(relative), np.nan, relative), initial=0.0)),
+            'rtol': tolerance['rtol'],
+            'atol': tolerance['atol'],
+            'changed_conclusions': flipped,
+            'passed': bool(same_missing and within and not flipped),
+        })
+
+    report = pd.DataFrame(rows)
+
+    file_name = f'results/{city}/precision_check.xlsx'
+    (writer or ReportWriter(background=False)).write(file_name, {'Sheet1': report}, index=False)
+
+    failed = report.loc[~report['passed'], 'table'] + ' ' + report.loc[~report['passed'], 'statistic']
+    if not failed.empty:
+        logging.error(f"Float32 results for {city} differ from float64 beyond the tolerances: {', '.join(failed)}.")
+        raise ValueError(f"Float32 results differ from float64 beyond the tolerances: {', '.join(failed)}.")
+
+    logging.info(f"Float32 results for {city} match float64 within the tolerances, comparison saved to {file_name}.")
+    return report
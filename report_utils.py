@@ -0,0 +1,174 @@
+import concurrent.futures
+import logging
+import os
+import pandas as pd
+
+class ReportWriter():
+    """
+    Class that collects the sheets of every workbook in memory and writes each workbook once, in a single pass,
+    on a background thread so that the analysis is not blocked by the writing.
+    A collecting writer keeps the workbooks instead of writing them, so that they can be handed to a writer in another process.
+    """
+
+    def __init__(self, background:bool=True, engine:str=None, collect:bool=False):
+        """
+        Constructor for the ReportWriter class.
+
+        Parameters
+        ----------
+        background : bool
+            Whether to write the workbooks on a background thread. Default is True.
+            If False, every workbook is written when it is submitted.
+        engine : str
+            The Excel engine. Default is None, xlsxwriter if it is installed and openpyxl otherwise.
+        collect : bool
+            Whether to keep the submitted workbooks in `collected` instead of writing them. Default is False.
+        """
+        if engine is None:
+            try:
+                import xlsxwriter
+                engine = 'xlsxwriter'
+            except ImportError:
+                engine = 'openpyxl'
+
+        self.engine = engine
+        self.pending = {}
+        self.futures = []
+        self.collect = collect
+        self.collected = []
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=1) if background and not collect else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, path:str, sheet_name:str, frame:pd.DataFrame, **kwargs):
+        """
+        Public method that adds a sheet to a workbook that is not written yet. The frame must not be modified afterwards.
+
+        Parameters
+        ----------
+        path : str
+            The path of the workbook.
+        sheet_name : str
+            The name of the sheet.
+        frame : pd.DataFrame
+            The content of the sheet.
+        **kwargs
+            Other arguments of DataFrame.to_excel, like index=False.
+
+        Returns
+        -------
+        None
+        """
+        self.pending.setdefault(path, {})[sheet_name] = (frame, kwargs)
+
+    def write(self, path:str, sheets:dict=None, **kwargs):
+        """
+        Public method that submits a workbook to be written, with the sheets added to it so far and the given sheets.
+
+        Parameters
+        ----------
+        path : str
+            The path of the workbook.
+        sheets : dict
+            The sheets to add, by name. Default is None.
+        **kwargs
+            Other arguments of DataFrame.to_excel for the given sheets, like index=False.
+
+        Returns
+        -------
+        None
+        """
+        for sheet_name, frame in (sheets or {}).items():
+            self.add(path, sheet_name, frame, **kwargs)
+
+        workbook = self.pending.pop(path, {})
+
+        if self.collect:
+            self.collected.append((path, workbook))
+        else:
+            self.submit(path, workbook)
+
+    def submit(self, path:str, workbook:dict) -> concurrent.futures.Future:
+        """
+        Public method that writes a workbook whose sheets are already collected, on the background thread if there is one.
+
+        Parameters
+        ----------
+        path : str
+            The path of the workbook.
+        workbook : dict
+            The sheets by name, each a (frame, to_excel arguments) pair.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            The future of the background write, None if the workbook is written right away.
+        """
+        if self.pool is None:
+            self.write_workbook(path, workbook)
+            return None
+
+        future = self.pool.submit(self.write_workbook, path, workbook)
+        self.futures.append(future)
+        return future
+
+    def write_workbook(self, path:str, workbook:dict):
+        """
+        Public method that writes all the sheets of a workbook in one pass. The workbook is written to a temporary file first
+        and then moved in place, so that an interrupted run never leaves a half written workbook.
+
+        Parameters
+        ----------
+        path : str
+            The path of the workbook.
+        workbook : dict
+            The sheets by name, each a (frame, to_excel arguments) pair.
+
+        Returns
+        -------
+        None
+        """
+        root, extension = os.path.splitext(path)
+        temporary = f'{root}.tmp{extension}'
+
+        with pd.ExcelWriter(temporary, engine=self.engine) as writer:
+            for sheet_name, (frame, kwargs) in workbook.items():
+                frame.to_excel(writer, sheet_name=sheet_name, **kwargs)
+
+        os.replace(temporary, path)
+
+        logging.info(f"Workbook {path} written with {len(workbook)} sheets.")
+
+    def flush(self):
+        """
+        Public method that writes the workbooks that still have added sheets, and waits until every submitted workbook is written.
+        The first error of a background write is raised here.
+
+        Returns
+        -------
+        None
+        """
+        for path in list(self.pending):
+            self.write(path)
+
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        """
+        Public method that flushes the writer and stops its background thread.
+
+        Returns
+        -------
+        None
+        """
+        try:
+            self.flush()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
@@ -0,0 +1,144 @@
+import logging
+import os
+import sqlite3
+import pandas as pd
+
+class ResultsStore():
+    """
+    Class that keeps the computed results of all the sites in one indexed SQLite table, so that they can be queried
+    without reading the workbooks. Every result is a row with the site, the test, the month, hour, term and label it belongs to,
+    and its value (a mean or a difference of means), statistic (F or t) and p-value. Fields that do not apply are NULL.
+    """
+
+    COLUMNS = ('site', 'test', 'month', 'hour', 'term', 'label', 'value', 'statistic', 'p')
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS results (
+            site TEXT NOT NULL,
+            test TEXT NOT NULL,
+            month INTEGER,
+            hour INTEGER,
+            term TEXT,
+            label TEXT,
+            value REAL,
+            statistic REAL,
+            p REAL
+        );
+        CREATE INDEX IF NOT EXISTS results_test ON results (test, month, hour);
+        CREATE INDEX IF NOT EXISTS results_site ON results (site, test);
+        CREATE INDEX IF NOT EXISTS results_p ON results (p);
+    """
+
+    def __init__(self, path:str='results/results.sqlite'):
+        """
+        Constructor for the ResultsStore class. The database is created if it does not exist.
+
+        Parameters
+        ----------
+        path : str
+            The path of the SQLite database. Default is 'results/results.sqlite'.
+        """
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+
+        self.path = path
+        # several stages may write at the same time from different processes
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(ResultsStore.SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def put(self, site:str, test:str, frame:pd.DataFrame):
+        """
+        Public method that stores the results of a test for a site, replacing the results stored before for the same site and test.
+
+        Parameters
+        ----------
+        site : str
+            The site name, 'all' for results of all the sites together. The frame can set the site of every row instead.
+        test : str
+            The test name, like 'anova_hourly_4Y' or 'ttest_11Y'.
+        frame : pd.DataFrame
+            The results, with some of the columns month, hour, term, label, value, statistic and p (and site, if it is set per row).
+
+        Returns
+        -------
+        None
+        """
+        frame = frame.reset_index(drop=True).copy()
+        if 'site' not in frame:
+            frame['site'] = site
+        frame['test'] = test
+        if 'label' in frame:
+            frame['label'] = frame['label'].map(lambda label: None if pd.isna(label) else str(label))
+        frame = frame.reindex(columns=ResultsStore.COLUMNS)
+
+        # sqlite only takes plain python values, missing values are stored as NULL
+        rows = [tuple(None if pd.isna(value) else value.item() if hasattr(value, 'item') else value for value in row)
+                for row in frame.itertuples(index=False, name=None)]
+
+        with self.connection:
+            self.connection.executemany('DELETE FROM results WHERE test = ? AND site = ?', [(test, name) for name in {site, *frame['site']}])
+            self.connection.executemany(f"INSERT INTO results VALUES ({', '.join('?' * len(ResultsStore.COLUMNS))})", rows)
+
+        logging.info(f"{len(rows)} {test} results for {site} stored in {self.path}.")
+
+    def query(self, site=None, test=None, month=None, hour=None, term=None, label=None, p_below:float=None) -> pd.DataFrame:
+        """
+        Public method that returns the stored results that match all the given filters.
+        Every filter can be a single value or a list of values, None means no filter.
+
+        Parameters
+        ----------
+        site : str or list
+            The site names. Default is None.
+        test : str or list
+            The test names. Default is None.
+        month : int or list
+            The months, from 1 to 12. Default is None.
+        hour : int or list
+            The hours, from 0 to 23. Default is None.
+        term : str or list
+            The ANOVA terms, like 'year' or 'site:year'. Default is None.
+        label : str or list
+            The labels, like a year or the compared blocks of a t-test. Default is None.
+        p_below : float
+            Only the results with a p-value below it, like 0.05 for the significant ones. Default is None.
+
+        Returns
+        -------
+        pd.DataFrame
+            The matching results.
+        """
+        conditions, parameters = [], []
+
+        for column, values in (('site', site), ('test', test), ('month', month), ('hour', hour), ('term', term), ('label', label)):
+            if values is None:
+                continue
+            values = list(values) if isinstance(values, (list, tuple, set)) else [values]
+            conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+            parameters += [str(value) if column == 'label' else value for value in values]
+
+        if p_below is not None:
+            conditions.append('p < ?')
+            parameters.append(p_below)
+
+        sql = 'SELECT * FROM results' + (' WHERE ' + ' AND '.join(conditions) if conditions else '')
+
+        return pd.read_sql_query(sql, self.connection, params=parameters)
+
+    def close(self):
+        """
+        Public method that closes the database.
+
+        Returns
+        -------
+        None
+        """
+        self.connection.close()
@@ -2,6 +2,12 @@ import pandas as pd
 import numpy as np
 import logging
 
+import kernel_utils
+from cube_utils import Cube
+from utils import year_blocks
+from report_utils import ReportWriter
+from results_utils import ResultsStore
+
 class TTest():
     """
     Class that performs a t-test on the data.
@@ -41,16 +47,21 @@ class TTest():
         t_stat, p_value = ttest_rel(data1, data2, alternative='greater')
         return t_stat, p_value
 
-    def ttest_results(self, data, agg:int):
+    def ttest_results(self, data, agg:int, writer:ReportWriter=None, store:ResultsStore=None):
         """
         Perform a t-test on the data and save the results to results folder.
+        Every block of years is compared with the next one, incomplete blocks at the end of the period are left out.
         
         Parameters
         ----------
-        data : pd.DataFrame
-            The data to perform the t-test on.
+        data : pd.DataFrame or Cube
+            The data to perform the t-test on, or its cube.
         agg : int
-            The yearly aggregation level of the data. Can be 4 or 11.
+            The yearly aggregation level of the data, the number of years in a block. Usually 4 or 11.
+        writer : ReportWriter
+            The writer that writes the results workbook. Default is None, the workbook is written right away.
+        store : ResultsStore
+            The store the results are also written to. Default is None, the results are only written to the workbook.
             
         Returns
         -------
@@ -59,85 +70,48 @@ class TTest():
 
         logging.info(f"Performing t-test on {self.city} data.")
 
-        data = data.copy()
-
-        data['local_time'] = data['local_time'].dt.year
-        data = data.groupby('local_time').sum()
-        #data.reset_index(inplace=True)
-        data = data.iloc[:-1,:] # remove 2024 data
-
-        if agg == 4:
-            data_4Y = {}
-
-            for i in range(1980, 2024, 4):
-                data_4Y[f'{i}-{i+3}'] = data.loc[i:i+3, 'electricity'].values.tolist()
-
-            table_4Y = {
-                'Block1': [],
-                'Block2': [],
-                'B1_mean': [],
-                'B2_mean': [],
-                'B2-B1': [],
-                't_stat': [],
-                'p_value': [],
-                'Reject H0': []
-            }
-
-            for i in range(0, 10):
-                block1 = data_4Y[f'{1980 + i * 4}-{1983 + i * 4}']
-                block2 = data_4Y[f'{1984 + i * 4}-{1987 + i * 4}']
-                t_stat, p_value = TTest.onetailed_paired_ttest(block1, block2)
-                reject_H0 = p_value < 0.05
-                table_4Y['Block1'].append(f'{1980 + i * 4}-{1983 + i * 4}')
-                table_4Y['Block2'].append(f'{1984 + i * 4}-{1987 + i * 4}')
-                table_4Y['B1_mean'].append(np.mean(block1))
-                table_4Y['B2_mean'].append(np.mean(block2))
-                table_4Y['B2-B1'].append(np.mean(block2) - np.mean(block1))
-                table_4Y['t_stat'].append(t_stat)
-                table_4Y['p_value'].append(p_value)
-                table_4Y['Reject H0'].append(reject_H0)
-
-            table_4Y = pd.DataFrame(table_4Y)
-
-            table_4Y.to_excel(f'results/{self.city}/ttest_4Y.xlsx', index=False)
-            logging.info(f"t-test results saved to results/{self.city}/ttest_4Y.xlsx.")
-
-        elif agg == 11:
-            data_11Y = {}
-
-            for i in range(1980, 2024, 11):
-                data_11Y[f'{i}-{i+10}'] = data.loc[i:i+10, 'electricity'].values.tolist()
-
-            table_11Y = {
-                'Block1': [],
-                'Block2': [],
-                'B1_mean': [],
-                'B2_mean': [],
-                'B2-B1': [],
-                't_stat': [],
-                'p_value': [],
-                'Reject H0': []
-            }
-
-            for i in range(0, 3):
-                block1 = data_11Y[f'{1980 + i * 11}-{1990 + i * 11}']
-                block2 = data_11Y[f'{1991 + i * 11}-{2001 + i * 11}']
-                t_stat, p_value = TTest.onetailed_paired_ttest(block1, block2)
-                reject_H0 = p_value < 0.05
-                table_11Y['Block1'].append(f'{1980 + i * 11}-{1990 + i * 11}')
-                table_11Y['Block2'].append(f'{1991 + i * 11}-{2001 + i * 11}')
-                table_11Y['B1_mean'].append(np.mean(block1))
-                table_11Y['B2_mean'].append(np.mean(block2))
-                table_11Y['B2-B1'].append(np.mean(block2) - np.mean(block1))
-                table_11Y['t_stat'].append(t_stat)
-                table_11Y['p_value'].append(p_value)
-                table_11Y['Reject H0'].append(reject_H0)
-
-            table_11Y = pd.DataFrame(table_11Y)
-
-            table_11Y.to_excel(f'results/{self.city}/ttest_11Y.xlsx', index=False)
-            logging.info(f"t-test results saved to results/{self.city}/ttest_11Y.xlsx.")
-
-        else:
+        if agg < 2:
             logging.error(f"Aggregation level {agg} is not supported.")
-            raise ValueError
\ No newline at end of file
+            raise ValueError
+
+        cube = Cube.of(data)
+        totals = cube.stats(('year',))[1].astype(np.float64)
+
+        codes, labels = year_blocks(cube.years, agg, partial='drop')
+        blocks = [totals[codes == i] for i in range(len(labels))]
+        means = kernel_utils.group_mean(codes, totals, len(labels))
+
+        table = {
+            'Block1': [],
+            'Block2': [],
+            'B1_mean': [],
+            'B2_mean': [],
+            'B2-B1': [],
+            't_stat': [],
+            'p_value': [],
+            'Reject H0': []
+        }
+
+        for i in range(len(blocks) - 1):
+            block1 = blocks[i]
+            block2 = blocks[i + 1]
+            t_stat, p_value = TTest.onetailed_paired_ttest(block1, block2)
+            reject_H0 = p_value < 0.05
+            table['Block1'].append(labels[i])
+            table['Block2'].append(labels[i + 1])
+            table['B1_mean'].append(means[i])
+            table['B2_mean'].append(means[i + 1])
+            table['B2-B1'].append(means[i + 1] - means[i])
+            table['t_stat'].append(t_stat)
+            table['p_value'].append(p_value)
+            table['Reject H0'].append(reject_H0)
+
+        table = pd.DataFrame(table)
+
+        (writer or ReportWriter(background=False)).write(f'results/{self.city}/ttest_{agg}Y.xlsx', {'Sheet1': table}, index=False)
+
+        if store is not None:
+            store.put(self.city, f'ttest_{agg}Y', pd.DataFrame({'label': table['Block1'].astype(str) + ' vs ' + table['Block2'].astype(str), 'value': table['B2-B1'],
+                                                                'statistic': table['t_stat'], 'p': table['p_value']}))
+
+        logging.info(f"t-test results saved to results/{self.city}/ttest_{agg}Y.xlsx.")
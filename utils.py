@@ -3,6 +3,8 @@ import logging
 import os
 import pandas as pd
 
+import kernel_utils
+
 class InputFetcher(abc.ABC):
     """
     Abstract class that fetches data from no matter what format and returns a pandas DataFrame.
@@ -94,7 +96,7 @@ class CSVInputFetcher(InputFetcher):
         """
         logging.info(f"Fetching aggregated data from {path} for years {year_range[0]} to {year_range[1]}.")
 
-        data = pd.DataFrame()
+        frames = []
         
         for year in range(year_range[0], year_range[1]+1):
             file_name = path + f"{year}.csv"
@@ -102,11 +104,42 @@ class CSVInputFetcher(InputFetcher):
                 logging.error(f"File {file_name} does not exist.")
                 raise FileNotFoundError
 
-            data = pd.concat([data, pd.read_csv(file_name, header=3)], ignore_index=True)
+            frames.append(pd.read_csv(file_name, header=3))
+
+        data = pd.concat(frames, ignore_index=True)
 
         logging.info(f"Aggregated data fetched from {path} for years {year_range[0]} to {year_range[1]}.")
 
         return data
+
+    def fetch_validated_data(path: str, year_range: list, col: str = 'electricity', fill: str = 'none', duplicates: str = 'mean', misaligned: str = 'error') -> pd.DataFrame:
+        """
+        Public class method that fetches the data from multiple csv files like fetch_aggregated_data, and validates it onto a regular hourly grid
+        with validate_hourly, so that the returned data is marked clean.
+
+        Parameters
+        ----------
+        path : str
+            The path to the csv files.
+        year_range : list
+            The range of years to fetch the data from.
+        col : str
+            The value column to keep. Default is 'electricity'.
+        fill : str
+            The fill policy for missing hours, see validate_hourly. Default is 'none'.
+        duplicates : str
+            The policy for duplicated hours, see validate_hourly. Default is 'mean'.
+        misaligned : str
+            The policy for times that are not on the hour, see validate_hourly. Default is 'error'.
+
+        Returns
+        -------
+        pd.DataFrame
+            The validated data, with 'local_time' and the value column.
+        """
+        data = CSVInputFetcher.fetch_aggregated_data(path, year_range)
+
+        return validate_hourly(data, year_range, col, fill, duplicates, misaligned)
     
 
 def File_Map(city:str):
@@ -155,4 +188,268 @@ def File_Map(city:str):
     if not os.path.exists(f'results/{city}'):
         os.makedirs(f'results/{city}')
 
-    logging.info(f"Folder structure created for {city}.")
\ No newline at end of file
+    logging.info(f"Folder structure created for {city}.")
+
+def validate_hourly(data: pd.DataFrame, year_range: list, col: str = 'electricity', fill: str = 'none', duplicates: str = 'mean', misaligned: str = 'error') -> pd.DataFrame:
+    """
+    This function validates hourly data in one vectorized pass and reindexes it onto the regular hourly grid of the whole years in the range.
+    It checks that 'local_time' is increasing, and detects duplicated hours (e.g. DST), times that are not on the hour and missing hours
+    (e.g. DST or a shifted leap day), each handled with the given policy.
+    The returned data has its validation report in data.attrs['validation'] and is marked clean with data.attrs['clean'],
+    so that downstream code can use the contiguous (years, 8784) layout of hourly_grid instead of grouping by timestamps.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The data in a pandas DataFrame, with a 'local_time' column.
+    year_range : list
+        The first and last year of the grid, rows outside of it are left out.
+    col : str
+        The value column to keep. Default is 'electricity'.
+    fill : str
+        The fill policy for missing hours. Default is 'none', missing hours are left as NaN and left out of the statistics.
+        Can be 'none', 'interpolate' (linear in time), 'ffill' (last value before the gap) or 'zero'.
+    duplicates : str
+        The policy for hours that appear more than once. Default is 'mean'. Can be 'mean', 'sum', 'first' or 'last'.
+    misaligned : str
+        The policy for times that are not on the hour, e.g. a site with a :30 offset. Default is 'error', a ValueError is raised.
+        Can be 'error', 'drop' (the rows are left out, their hours are missing) or 'floor' (the values are moved to the start of their hour).
+
+    Returns
+    -------
+    pd.DataFrame
+        The data on the regular hourly grid, with 'local_time' and the value column.
+    """
+    import numpy as np
+
+    if fill not in ('interpolate', 'ffill', 'zero', 'none') or duplicates not in ('mean', 'sum', 'first', 'last') or misaligned not in ('error', 'drop', 'floor'):
+        logging.error(f"Fill policy {fill}, duplicates policy {duplicates} or misaligned policy {misaligned} is not supported.")
+        raise ValueError
+
+    logging.info(f"Validating {len(data)} rows for years {year_range[0]} to {year_range[1]}.")
+
+    start = pd.Timestamp(year=year_range[0], month=1, day=1)
+    grid = pd.date_range(start, pd.Timestamp(year=year_range[1], month=12, day=31, hour=23), freq='h')
+
+    # wall clock time, an offset in the timestamps is dropped
+    local_time = pd.to_datetime(data['local_time'])
+    if local_time.dt.tz is not None:
+        local_time = local_time.dt.tz_localize(None)
+
+    # hours since the start of the grid
+    nanoseconds = local_time.to_numpy(dtype='datetime64[ns]').astype('int64') - start.value
+    hours = nanoseconds // 3_600_000_000_000
+    values = data[col].to_numpy(dtype=float)
+
+    steps = np.diff(hours)
+    inside = (hours >= 0) & (hours < len(grid))
+    # times inside the years that are not on the hour
+    off_hour = inside & (nanoseconds % 3_600_000_000_000 != 0)
+    report = {
+        'rows': len(data),
+        'misaligned': int(off_hour.sum()),
+        'non_monotonic': int((steps < 0).sum()),
+        'outside': int((~inside).sum()),
+    }
+
+    if report['misaligned'] and misaligned == 'error':
+        logging.error(f"{report['misaligned']} times are not on the hour, choose the 'drop' or 'floor' misaligned policy to use the data.")
+        raise ValueError
+
+    # with the 'floor' policy the misaligned rows stay, floored onto the start of their hour
+    if misaligned == 'drop':
+        inside &= ~off_hour
+    hours, values = hours[inside], values[inside]
+
+    if report['non_monotonic']:
+        order = np.argsort(hours, kind='stable')
+        hours, values = hours[order], values[order]
+
+    # duplicated hours, e.g. the repeated hour when DST ends
+    repeated = np.r_[False, hours[1:] == hours[:-1]]
+    report['duplicates'] = int(repeated.sum())
+
+    if report['duplicates'] and duplicates in ('mean', 'sum'):
+        counts, sums, _ = kernel_utils.group_stats(hours, values, len(grid))
+        unique = np.unique(hours)
+        values = sums[unique] / counts[unique] if duplicates == 'mean' else sums[unique]
+        values[counts[unique] == 0] = np.nan
+        hours = unique
+    elif report['duplicates']:
+        keep = ~repeated if duplicates == 'first' else ~np.r_[hours[1:] == hours[:-1], False]
+        hours, values = hours[keep], values[keep]
+
+    series = np.full(len(grid), np.nan)
+    series[hours] = values
+
+    missing = np.isnan(series)
+    report['gaps'] = int(missing.sum())
+
+    if report['gaps'] and fill == 'interpolate' and not missing.all():
+        positions = np.arange(len(grid))
+        series[missing] = np.interp(positions[missing], positions[~missing], series[~missing])
+    elif report['gaps'] and fill == 'ffill':
+        last = np.maximum.accumulate(np.where(missing, 0, np.arange(len(grid))))
+        series = series[last]
+    elif report['gaps'] and fill == 'zero':
+        series[missing] = 0.0
+
+    report['filled'] = int(missing.sum() - np.isnan(series).sum())
+
+    if report['misaligned'] or report['non_monotonic'] or report['duplicates'] or report['gaps']:
+        logging.warning(f"Validation found {report['misaligned']} misaligned ({misaligned}), {report['non_monotonic']} out of order, {report['duplicates']} duplicated "
+                        f"and {report['gaps']} missing hours, {report['filled']} filled with policy {fill}.")
+
+    clean = pd.DataFrame({'local_time': grid, col: series})
+    clean.attrs['validation'] = report
+    clean.attrs['clean'] = True
+
+    logging.info(f"Validated data on a regular hourly grid of {len(grid)} hours.")
+    return clean
+
+
+def is_hourly_grid(data: pd.DataFrame) -> bool:
+    """
+    This function checks, in one vectorized pass, that the rows are the full and ordered hourly grid of whole years that validate_hourly returns:
+    the first time is January 1st 00:00, the times step by exactly one hour and there are as many rows as hours in the years.
+    The clean flag alone is not enough, pandas keeps it through filtering and sorting.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The data in a pandas DataFrame, with a datetime 'local_time' column.
+
+    Returns
+    -------
+    bool
+        Whether the rows are the hourly grid of their years.
+    """
+    import numpy as np
+
+    if len(data) == 0:
+        return False
+
+    time = data['local_time']
+    first, last = time.iloc[0], time.iloc[-1]
+    if first != pd.Timestamp(year=first.year, month=1, day=1, tz=first.tz):
+        return False
+
+    years = np.arange(first.year, last.year + 1)
+    leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    if len(data) != np.where(leap, 8784, 8760).sum():
+        return False
+
+    nanoseconds = time.to_numpy(dtype='datetime64[ns]').astype('int64')
+    return bool((np.diff(nanoseconds) == 3_600_000_000_000).all())
+
+
+def hourly_grid(data: pd.DataFrame, col: str = 'electricity') -> tuple:
+    """
+    This function reshapes clean hourly data (see validate_hourly and is_hourly_grid) into a contiguous (years, 8784) array without grouping by timestamps.
+    Every row is one year and every column one hour of the year, non-leap years are padded with NaN after their 8760 hours.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The clean data in a pandas DataFrame.
+    col : str
+        The value column. Default is 'electricity'.
+
+    Returns
+    -------
+    np.ndarray
+        The years of the rows.
+    np.ndarray
+        The values, with shape (years, 8784).
+    """
+    import numpy as np
+
+    if not data.attrs.get('clean') or not is_hourly_grid(data):
+        logging.error("The data is not the full hourly grid of its years, validate it with validate_hourly first.")
+        raise ValueError
+
+    first = data['local_time'].iloc[0].year
+    last = data['local_time'].iloc[-1].year
+    years = np.arange(first, last + 1)
+    leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    lengths = np.where(leap, 8784, 8760)
+
+    # the grid is stored in the precision selected in kernel_utils
+    values = data[col].to_numpy(dtype=kernel_utils.float_type())
+    grid = np.full((len(years), 8784), np.nan, dtype=values.dtype)
+
+    # the rows and columns of every value, all years start at column 0
+    rows = np.repeat(np.arange(len(years)), lengths)
+    columns = np.arange(len(values)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    grid[rows, columns] = values
+
+    return years, grid
+
+
+def year_blocks(years, length:int, align:int=None, partial:str='keep') -> tuple:
+    """
+    This function bins the years into blocks of a given number of years in one vectorized pass.
+
+    Parameters
+    ----------
+    years : array-like
+        The sorted, consecutive years to bin.
+    length : int
+        The number of years in a block.
+    align : int
+        A year that starts a block, the other blocks are laid out every `length` years from it. Default is None, the first year.
+    partial : str
+        What to do with blocks that have fewer than `length` years. Default is 'keep'.
+        Can be 'keep' (partial blocks are groups of their own), 'drop' (their years get the code -1)
+        or 'merge' (they are merged into the neighbouring full block).
+
+    Returns
+    -------
+    np.ndarray
+        The block code of every year, -1 for dropped years.
+    list
+        The label of every block, like '1980-1983'.
+    """
+    import numpy as np
+
+    years = np.asarray(years, dtype=int)
+
+    if length < 1 or len(years) == 0:
+        logging.error(f"Cannot bin {len(years)} years into blocks of {length} years.")
+        raise ValueError
+
+    if partial not in ('keep', 'drop', 'merge'):
+        logging.error(f"Partial block policy {partial} is not supported.")
+        raise ValueError
+
+    start = years[0] if align is None else align
+    _, codes, counts = np.unique((years - start) // length, return_inverse=True, return_counts=True)
+    full = counts == length
+
+    if partial == 'keep' or full.all():
+        pass
+
+    elif partial == 'drop':
+        # renumber the full blocks and drop the others
+        renumber = np.where(full, np.cumsum(full) - 1, -1)
+        codes = renumber[codes]
+
+    elif partial == 'merge':
+        if not full.any():
+            logging.error(f"No full block of {length} years to merge the partial blocks into.")
+            raise ValueError
+        # a partial block goes to the next full block, or the previous one at the end of the range
+        block = np.arange(len(counts))
+        next_full = np.minimum.accumulate(np.where(full, block, len(counts))[::-1])[::-1]
+        previous_full = np.maximum.accumulate(np.where(full, block, -1))
+        target = np.where(next_full < len(counts), next_full, previous_full)
+        codes = (np.cumsum(full) - 1)[target][codes]
+
+    kept = codes >= 0
+    first = np.full(codes.max() + 1, years.max())
+    last = np.full(codes.max() + 1, years.min())
+    np.minimum.at(first, codes[kept], years[kept])
+    np.maximum.at(last, codes[kept], years[kept])
+    labels = [f'{a}' if a == b else f'{a}-{b}' for a, b in zip(first, last)]
+
+    return codes, labels